@@ -0,0 +1,104 @@
+#-*-coding:utf8-*-
+
+"""
+爬取基准测试：在子进程中启动本地服务器，从/page/0开始爬取全部页面，
+统计每秒页面数、请求耗时p50/p99及峰值内存，结果以json保存到benchmarks/results
+
+    python benchmarks/bench_crawl.py --pages 2000 --latency 20 --fanout 5 --concurrency 20
+"""
+
+import argparse
+import logging
+import multiprocessing
+import socket
+import time
+
+import common
+import server
+
+from ruia_study.request import Request
+from ruia_study.spider import Spider
+
+
+class BenchSpider(Spider):
+    name = 'bench'
+    start_urls = []
+
+    async def parse(self, res):
+        if res.html is None:
+            return
+        for href in res.html_etree.xpath('//a[@class="link"]/@href'):
+            yield Request(self.base_url + href, callback=self.parse, request_config=self.request_config)
+
+
+def wait_for_port(host, port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Benchmark server did not start on {host}:{port}')
+
+
+def run_crawl(base_url, concurrency, retries):
+    latencies = []
+
+    #记录每个请求从发出到读取完响应的耗时
+    def after_start(spider_ins):
+        record_response = spider_ins.stats.record_response
+
+        def record(request, response):
+            latencies.append(request.timings.get('ttfb', 0) + request.timings.get('download', 0))
+            record_response(request, response)
+
+        spider_ins.stats.record_response = record
+
+    BenchSpider.base_url = base_url
+    BenchSpider.start_urls = [base_url + '/page/0']
+    BenchSpider.concurrency = concurrency
+    BenchSpider.request_config = dict(Request.REQUEST_CONFIG, RETRIES=retries)
+    BenchSpider.stats_config = {'LOG_INTERVAL': 0}
+    start = time.perf_counter()
+    spider_ins = BenchSpider.start(after_start=after_start)
+    elapsed = time.perf_counter() - start
+    pages = spider_ins.success_counts + spider_ins.failed_counts
+    return {
+        'pages': pages,
+        'success': spider_ins.success_counts,
+        'failed': spider_ins.failed_counts,
+        'elapsed': round(elapsed, 4),
+        'pages_per_sec': round(pages / elapsed, 2),
+        'latency_p50_ms': round(common.percentile(latencies, 0.5) * 1000, 3),
+        'latency_p99_ms': round(common.percentile(latencies, 0.99) * 1000, 3),
+        'peak_rss_mb': round(common.peak_rss_mb(), 1),
+        'bytes': spider_ins.stats.total_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    server.add_arguments(parser)
+    parser.add_argument('--port', type=int, default=8880)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--retries', type=int, default=0, help='RETRIES for failed pages')
+    parser.add_argument('--output', default=None, help='result json path')
+    args = parser.parse_args()
+    #请求日志会显著影响结果
+    logging.disable(logging.INFO)
+
+    server_process = multiprocessing.Process(target=server.run, kwargs=dict(port=args.port, **server.app_options(args)),
+                                             daemon=True)
+    server_process.start()
+    try:
+        wait_for_port('127.0.0.1', args.port)
+        results = run_crawl(f'http://127.0.0.1:{args.port}', args.concurrency, args.retries)
+    finally:
+        server_process.terminate()
+        server_process.join()
+    common.write_results('crawl', vars(args), results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#-*-coding:utf8-*-
+
+"""
+字段提取基准测试：对包含items个节点的页面重复执行Item.get_items，
+减去只提取target_item的基准耗时，得到TextField、AttrField每个item的提取耗时(微秒)
+
+    python benchmarks/bench_extract.py --items 200 --repeat 200
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+
+import common
+
+from lxml import etree
+
+from ruia_study.fields import AttrField, TextField
+from ruia_study.item import Item
+
+
+class TargetItem(Item):
+    target_item = TextField(css_select='li.item')
+
+
+class TextItem(Item):
+    target_item = TextField(css_select='li.item')
+    title = TextField(css_select='a.link')
+
+
+class TextXPathItem(Item):
+    target_item = TextField(css_select='li.item')
+    title = TextField(xpath_select='./a/text()')
+
+
+class AttrItem(Item):
+    target_item = TextField(css_select='li.item')
+    href = AttrField(css_select='a.link', attr='href')
+
+
+class AttrXPathItem(Item):
+    target_item = TextField(css_select='li.item')
+    href = AttrField(xpath_select='./a/@href', attr='href')
+
+
+def make_html(items):
+    nodes = ''.join(
+        f'<li class="item"><a class="link" href="/page/{i}" title="page {i}">page <b>{i}</b></a></li>'
+        for i in range(items)
+    )
+    return f'<html><body><ul>{nodes}</ul></body></html>'
+
+
+#返回每次get_items的平均耗时(秒)
+def time_get_items(item_cls, html_etree, repeat):
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(item_cls.get_items(html_etree=html_etree))
+        start = time.perf_counter()
+        for _ in range(repeat):
+            loop.run_until_complete(item_cls.get_items(html_etree=html_etree))
+        return (time.perf_counter() - start) / repeat
+    finally:
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=200, help='item nodes per page')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output', default=None, help='result json path')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    html = make_html(args.items)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        html_etree = etree.HTML(html)
+    parse_time = (time.perf_counter() - start) / args.repeat
+
+    baseline = time_get_items(TargetItem, html_etree, args.repeat)
+    results = {
+        'html_bytes': len(html),
+        'parse_ms': round(parse_time * 1000, 4),
+        'target_item_us_per_item': round(baseline / args.items * 1e6, 4),
+    }
+    for name, item_cls in (('text_css', TextItem), ('text_xpath', TextXPathItem),
+                           ('attr_css', AttrItem), ('attr_xpath', AttrXPathItem)):
+        elapsed = time_get_items(item_cls, html_etree, args.repeat)
+        results[f'{name}_us_per_item'] = round((elapsed - baseline) / args.items * 1e6, 4)
+    results['peak_rss_mb'] = round(common.peak_rss_mb(), 1)
+    common.write_results('extract', vars(args), results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#-*-coding:utf8-*-
+
+"""
+请求创建基准测试：回调中大量yield Request时的创建耗时(微秒/个)及每个请求占用的内存(字节)，
+另测请求在队列中转换为RequestDescriptor再还原的耗时
+
+    python benchmarks/bench_request.py --number 100000
+"""
+
+import argparse
+import gc
+import logging
+import time
+import tracemalloc
+
+import common
+
+from ruia_study.frontier import RequestDescriptor
+from ruia_study.request import Request
+
+HEADERS = {'User-Agent': 'Mozilla/5.0 (bench)', 'Accept-Language': 'zh-CN,zh;q=0.9'}
+
+
+def callback(res):
+    pass
+
+
+#按回调中常见的写法创建请求：仅url及回调，或同时带上爬虫的headers、metadata
+def make_requests(number, with_options):
+    if with_options:
+        return [Request(f'http://127.0.0.1/page/{i}', callback=callback, headers=HEADERS, metadata={'page': i})
+                for i in range(number)]
+    return [Request(f'http://127.0.0.1/page/{i}', callback=callback) for i in range(number)]
+
+
+#返回每个请求的创建耗时(秒)，url等字符串的创建也计算在内
+def time_create(number, with_options, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        make_requests(number, with_options)
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+#返回每个请求占用的内存(字节)
+def request_memory(number, with_options):
+    gc.collect()
+    tracemalloc.start()
+    requests = make_requests(number, with_options)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del requests
+    return size / number
+
+
+def time_descriptor(number, repeat):
+    requests = make_requests(number, True)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for request in requests:
+            RequestDescriptor(request).to_request()
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--number', type=int, default=100000, help='requests per round')
+    parser.add_argument('--repeat', type=int, default=5, help='rounds, the fastest is reported')
+    parser.add_argument('--output', default=None, help='result json path')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    results = {
+        'create_us': round(time_create(args.number, False, args.repeat) * 1e6, 4),
+        'create_with_options_us': round(time_create(args.number, True, args.repeat) * 1e6, 4),
+        'bytes_per_request': round(request_memory(args.number, False), 1),
+        'bytes_per_request_with_options': round(request_memory(args.number, True), 1),
+        'descriptor_round_trip_us': round(time_descriptor(args.number, args.repeat) * 1e6, 4),
+        'peak_rss_mb': round(common.peak_rss_mb(), 1),
+    }
+    common.write_results('request', vars(args), results, args.output)
+
+
+if __name__ == '__main__':
+    main()
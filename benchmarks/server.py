@@ -0,0 +1,73 @@
+#-*-coding:utf8-*-
+
+"""
+本地基准测试服务器，模拟目标网站的延迟、页面大小、错误率及每页的链接数
+
+    python benchmarks/server.py --port 8880 --latency 50 --size 20000 --error-rate 0.01 --fanout 5 --pages 2000
+"""
+
+import argparse
+import asyncio
+import random
+
+from aiohttp import web
+
+
+#生成页面，/page/{n}链接到/page/{n*fanout+1}至/page/{n*fanout+fanout}，编号不超过pages
+def make_page(n, size, fanout, pages):
+    links = ''.join(
+        f'<li class="item"><a class="link" href="/page/{i}" title="page {i}">page {i}</a></li>'
+        for i in range(n * fanout + 1, n * fanout + fanout + 1) if i < pages
+    )
+    body = f'<html><head><title>page {n}</title></head><body><h1>page {n}</h1><ul>{links}</ul>'
+    #用注释填充到指定大小，不影响解析结果
+    filler = max(0, size - len(body) - len('<!----></body></html>'))
+    return f'{body}<!--{"x" * filler}--></body></html>'
+
+
+def make_app(latency=0, jitter=0, size=10000, error_rate=0, fanout=3, pages=1000, seed=0):
+    rnd = random.Random(seed)
+
+    async def page(request):
+        n = int(request.match_info['n'])
+        #延迟单位为毫秒，jitter为上下浮动的比例
+        delay = latency * (1 + rnd.uniform(-jitter, jitter)) / 1000
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if n >= pages:
+            return web.Response(status=404)
+        if error_rate and rnd.random() < error_rate:
+            return web.Response(status=500)
+        return web.Response(text=make_page(n, size, fanout, pages), content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get('/page/{n}', page)
+    return app
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0, help='response latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='latency jitter ratio, e.g. 0.2')
+    parser.add_argument('--size', type=int, default=10000, help='page size in bytes')
+    parser.add_argument('--error-rate', type=float, default=0, help='ratio of 500 responses')
+    parser.add_argument('--fanout', type=int, default=3, help='links per page')
+    parser.add_argument('--pages', type=int, default=1000, help='total pages')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def app_options(args):
+    return dict(latency=args.latency, jitter=args.jitter, size=args.size, error_rate=args.error_rate,
+                fanout=args.fanout, pages=args.pages, seed=args.seed)
+
+
+def run(host='127.0.0.1', port=8880, **options):
+    web.run_app(make_app(**options), host=host, port=port, print=None, access_log=None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8880)
+    add_arguments(parser)
+    args = parser.parse_args()
+    run(args.host, args.port, **app_options(args))
@@ -0,0 +1,146 @@
+#-*-coding:utf8-*-
+
+import asyncio
+import os
+import pickle
+import zlib
+
+from collections import OrderedDict
+from functools import partial
+
+from multidict import CIMultiDict
+
+from ruia_study.dupefilter import request_fingerprint
+from ruia_study.middleware import Middleware
+from ruia_study.response import Response
+from ruia_study.utils.log import get_logger
+
+
+#基于磁盘的响应缓存中间件，请求中间件命中缓存时直接返回Response而不发起请求，
+#响应中间件保存新的成功响应；缓存以请求指纹为key，超过max_size字节时按LRU淘汰，
+#replay_only为True时只读取缓存，未命中的请求也不会访问网络
+class CacheMiddleware(Middleware):
+
+    name = 'Cache'
+
+    def __init__(self, cache_dir='.ruia_cache', *, max_size=None, compress=True, replay_only=False):
+        super(CacheMiddleware, self).__init__()
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.compress = compress
+        self.replay_only = replay_only
+        self.logger = get_logger(name=self.name)
+        os.makedirs(cache_dir, exist_ok=True)
+        #按最近访问时间排序的缓存索引，key为指纹，value为文件大小
+        self.index = OrderedDict()
+        self.total_size = 0
+        self._load_index()
+        self._evict()
+        self.request_middleware.append(self.process_request)
+        self.response_middleware.append(self.process_response)
+
+    #扫描缓存目录，按文件修改时间(命中时会更新)恢复LRU顺序
+    def _load_index(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith('.cache'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-6], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.total_size += size
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.cache')
+
+    def _read(self, key):
+        path = self._path(key)
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)
+        if data[:1] == b'z':
+            return pickle.loads(zlib.decompress(data[1:]))
+        return pickle.loads(data[1:])
+
+    def _write(self, key, record):
+        data = pickle.dumps(record)
+        data = b'z' + zlib.compress(data) if self.compress else b'p' + data
+        with open(self._path(key), 'wb') as f:
+            f.write(data)
+        return len(data)
+
+    #超过缓存大小时删除最久未访问的缓存
+    def _evict(self):
+        while self.max_size is not None and self.total_size > self.max_size and self.index:
+            key, size = self.index.popitem(last=False)
+            self.total_size -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    #请求中间件，命中缓存时返回Response，文件读写在线程池中执行
+    async def process_request(self, request):
+        fp = request_fingerprint(request)
+        key = None if fp is None else fp.hex()
+        loop = asyncio.get_event_loop()
+        if key is not None and key in self.index:
+            self.index.move_to_end(key)
+            try:
+                record = await loop.run_in_executor(None, partial(self._read, key))
+            except Exception as e:
+                self.logger.error(f'<Cache read error: {request.url} {e}>')
+                self.total_size -= self.index.pop(key, 0)
+            else:
+                return Response(url=record['url'],
+                                html=record['html'],
+                                body=record.get('body'),
+                                encoding=record.get('encoding'),
+                                metadata=request.metadata,
+                                res_type=record['res_type'],
+                                cookies=record['cookies'],
+                                headers=CIMultiDict(record['headers']),
+                                history=(),
+                                status=record['status'])
+        if self.replay_only:
+            self.logger.warning(f'<Cache miss in replay only mode: {request.url}>')
+            return Response(url=request.url,
+                            html=None,
+                            metadata=request.metadata,
+                            res_type=request.res_type,
+                            cookies=None,
+                            headers={},
+                            history=(),
+                            status=504)
+        return None
+
+    #响应中间件，保存成功的响应
+    async def process_response(self, request, response):
+        #stream响应为临时文件，不缓存
+        if response.body is None and response.html is None or self.replay_only or request.res_type == 'stream':
+            return
+        fp = request_fingerprint(request)
+        #请求体无法读取的请求不缓存
+        if fp is None or fp.hex() in self.index:
+            return
+        key = fp.hex()
+        record = {
+            'url': response.url,
+            #有原始响应体时只保存响应体及编码，不必解码
+            'html': response.html if response.body is None else None,
+            'body': response.body,
+            'encoding': response.encoding,
+            'res_type': request.res_type,
+            'status': response.status,
+            'headers': list((response.headers or {}).items()),
+            'cookies': {name: getattr(cookie, 'value', cookie) for name, cookie in (response.cookies or {}).items()},
+        }
+        loop = asyncio.get_event_loop()
+        try:
+            size = await loop.run_in_executor(None, partial(self._write, key, record))
+        except Exception as e:
+            self.logger.error(f'<Cache write error: {request.url} {e}>')
+            return
+        self.index[key] = size
+        self.total_size += size
+        self._evict()
@@ -0,0 +1,195 @@
+#-*-coding:utf8-*-
+
+import asyncio
+import errno
+import time
+
+from collections import deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+import aiohttp
+
+from ruia_study.settings import CONCURRENCY_CONFIG
+from ruia_study.utils.log import get_logger
+
+#本机资源不足导致的连接错误，与目标域名无关
+LOCAL_ERRNOS = frozenset((errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM, errno.EADDRNOTAVAIL))
+
+
+#可调整上限的信号量，上限降低时已占用的不会被收回，归还后才按新上限分配
+class AIMDLimiter:
+
+    def __init__(self, name, initial, min_limit, max_limit, config, logger, adaptive=True):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.increase = config['INCREASE']
+        self.decrease = config['DECREASE']
+        self.latency_factor = config['LATENCY_FACTOR']
+        self.logger = logger
+        self.adaptive = adaptive
+        self.in_flight = 0
+        self.decrease_counts = 0
+        #首字节耗时的基准，降低时立即跟随，升高时缓慢跟随
+        self.baseline = None
+        self._last_decrease = 0
+        self._waiters = deque()
+
+    async def acquire(self):
+        while self.in_flight >= int(self.limit):
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    #已被唤醒后才取消，唤醒下一个
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    #根据响应调整上限，overloaded为True表示目标过载，started_at为该请求发出的时间
+    def feedback(self, overloaded, latency=None, started_at=None):
+        if not self.adaptive:
+            return
+        if not overloaded and latency is not None:
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+            else:
+                self.baseline += (latency - self.baseline) * 0.01
+                overloaded = latency > self.baseline * self.latency_factor
+        old_limit = int(self.limit)
+        if overloaded:
+            #同一轮发出的请求同时失败时只减少一次
+            if started_at is not None and started_at < self._last_decrease:
+                return
+            self._last_decrease = time.monotonic()
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+            self.decrease_counts += 1
+            if int(self.limit) != old_limit:
+                self.logger.info(f'<Concurrency {self.name}: {old_limit} -> {int(self.limit)}>')
+        #并发未用到一半时说明瓶颈不在目标，不增加
+        elif self.in_flight + 1 >= self.limit / 2:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            if int(self.limit) != old_limit:
+                self.logger.debug(f'<Concurrency {self.name}: {old_limit} -> {int(self.limit)}>')
+                self._wake()
+
+    def to_dict(self):
+        return {'limit': int(self.limit), 'in_flight': self.in_flight, 'decrease_counts': self.decrease_counts,
+                'baseline': self.baseline}
+
+
+#代替原来固定的asyncio.Semaphore，请求需同时获得所属域名及全局的并发名额
+class ConcurrencyController:
+
+    name = 'Concurrency'
+
+    def __init__(self, concurrency=3, config=None, stats=None):
+        self.config = dict(CONCURRENCY_CONFIG, **(config or {}))
+        self.adaptive = self.config['ADAPTIVE']
+        self.logger = get_logger(name=self.name)
+        if self.adaptive:
+            self.global_limiter = AIMDLimiter('global', concurrency, self.config['MIN'], self.config['MAX'],
+                                              self.config, self.logger)
+            self.max_concurrency = self.config['MAX']
+        else:
+            self.global_limiter = AIMDLimiter('global', concurrency, concurrency, concurrency,
+                                              self.config, self.logger, adaptive=False)
+            self.max_concurrency = concurrency
+        self.host_limiters = {}
+        #最近有响应及最近过载的域名及其时间，用于判断是否大部分域名同时过载
+        self.host_seen = {}
+        self.host_overloaded = {}
+        #调整结果在输出统计信息时由to_dict获取
+        if stats is not None:
+            stats.extra['concurrency'] = self
+
+    def get_host_limiter(self, url):
+        host = urlparse(url).hostname or ''
+        limiter = self.host_limiters.get(host)
+        if limiter is None:
+            limiter = AIMDLimiter(host, self.config['HOST_INITIAL'], self.config['HOST_MIN'], self.config['HOST_MAX'],
+                                  self.config, self.logger)
+            self.host_limiters[host] = limiter
+        return limiter
+
+    #先获取域名的名额再获取全局的名额，等待某个域名时不占用全局名额
+    @asynccontextmanager
+    async def slot(self, url):
+        host_limiter = self.get_host_limiter(url) if self.adaptive else None
+        if host_limiter is not None:
+            await host_limiter.acquire()
+        try:
+            await self.global_limiter.acquire()
+            try:
+                yield
+            finally:
+                self.global_limiter.release()
+        finally:
+            if host_limiter is not None:
+                host_limiter.release()
+
+    #超时、连接错误、429及5xx视为过载，其它错误不调整
+    @staticmethod
+    def is_overloaded(response, exception):
+        if exception is not None:
+            return isinstance(exception, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
+        return response.status == 429 or response.status >= 500
+
+    #文件描述符耗尽等本机的连接错误
+    @staticmethod
+    def is_local_error(exception):
+        return isinstance(exception, aiohttp.ClientOSError) and exception.errno in LOCAL_ERRNOS
+
+    #过载及耗时只调整所属域名的并发数，某个域名变慢或出错不影响其它域名；
+    #全局并发数只按本机的连接错误或大部分域名同时过载减少
+    def feedback(self, request, response, started_at=None):
+        if not self.adaptive:
+            return
+        if self.is_local_error(request.exception):
+            self.global_limiter.feedback(True, started_at=started_at)
+            return
+        overloaded = self.is_overloaded(response, request.exception)
+        if not overloaded and request.exception is not None:
+            return
+        host_limiter = self.get_host_limiter(request.url)
+        host_limiter.feedback(overloaded, request.timings.get('ttfb'), started_at)
+        now = time.monotonic()
+        self.host_seen[host_limiter.name] = now
+        if overloaded:
+            self.host_overloaded[host_limiter.name] = now
+        self.global_limiter.feedback(overloaded and self._mostly_overloaded(now), started_at=started_at)
+
+    #最近GLOBAL_WINDOW秒内有响应的域名中过载的是否足够多
+    def _mostly_overloaded(self, now):
+        window_start = now - self.config['GLOBAL_WINDOW']
+        for hosts in (self.host_seen, self.host_overloaded):
+            for host in [host for host, seen_at in hosts.items() if seen_at < window_start]:
+                del hosts[host]
+        overloaded = len(self.host_overloaded)
+        return (overloaded >= self.config['GLOBAL_MIN_HOSTS']
+                and overloaded >= len(self.host_seen) * self.config['GLOBAL_OVERLOAD_RATIO'])
+
+    def to_dict(self):
+        return {
+            'adaptive': self.adaptive,
+            'global': self.global_limiter.to_dict(),
+            'hosts': {host: limiter.to_dict() for host, limiter in self.host_limiters.items()},
+        }
@@ -0,0 +1,160 @@
+#-*-coding:utf8-*-
+
+import hashlib
+import json
+import math
+
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from ruia_study.settings import DUPEFILTER_CONFIG
+
+#各协议的默认端口，规范化时去掉
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+#规范化url：协议和域名小写，去掉默认端口和锚点，查询参数排序
+def canonicalize_url(url):
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or '').lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{parts.port}'
+    if parts.username:
+        userinfo = parts.username + (f':{parts.password}' if parts.password else '')
+        netloc = f'{userinfo}@{netloc}'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+#获取请求体，用于区分url相同但提交内容不同的POST请求；
+#FormData、文件对象、生成器等无法直接读取的请求体返回None，不抛出异常
+def _request_body(request):
+    kwargs = request.kwargs
+    try:
+        if kwargs.get('json') is not None:
+            return json.dumps(kwargs['json'], sort_keys=True, default=str).encode('utf-8')
+        data = kwargs.get('data')
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            return urlencode(sorted(data.items())).encode('utf-8')
+        #[('a', '1')]形式的表单，与字典相同按urlencode计算，同名参数的顺序有意义，不排序
+        if isinstance(data, (list, tuple)):
+            return urlencode(data).encode('utf-8')
+        if isinstance(data, str):
+            return data.encode('utf-8')
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return bytes(data)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+#请求指纹，由请求方法、规范化后的url及请求体计算sha1；
+#请求体无法读取或url无法解析(如端口无效)时返回None，此类请求不去重也不缓存
+def request_fingerprint(request):
+    body = _request_body(request)
+    if body is None:
+        return None
+    try:
+        url = canonicalize_url(request.url)
+    except ValueError:
+        return None
+    fp = hashlib.sha1()
+    fp.update(request.method.encode('utf-8'))
+    fp.update(url.encode('utf-8'))
+    fp.update(body)
+    return fp.digest()
+
+
+#精确去重，保存所有指纹，内存占用随请求数增长
+class SetDupeFilter:
+
+    def __init__(self):
+        self.fingerprints = set()
+        #上次保存后新增的指纹，持久化队列只需保存这部分
+        self.unsaved = []
+
+    #判断请求是否出现过，未出现过则记录下来
+    def request_seen(self, request):
+        fp = request_fingerprint(request)
+        if fp is None:
+            return False
+        if fp in self.fingerprints:
+            return True
+        self.fingerprints.add(fp)
+        self.unsaved.append(fp)
+        return False
+
+    #取出上次保存后的变化，返回(是否为完整状态, 状态)，开销只与新增的指纹数有关
+    def take_changes(self):
+        changes, self.unsaved = self.unsaved, []
+        return False, changes
+
+    #恢复take_changes保存的状态
+    def apply_changes(self, changes):
+        self.fingerprints.update(changes)
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+#布隆过滤器去重，按预计请求数capacity及误判率error_rate分配固定大小的内存，
+#误判时会把未请求过的url当作重复请求丢弃
+class BloomDupeFilter:
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        #位数组大小 m = -n*ln(p)/(ln2)^2，哈希函数个数 k = m/n*ln2
+        self.bit_size = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_size / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_size + 7) // 8)
+        self.count = 0
+
+    #由指纹得到k个位置，使用双重哈希 h1 + i*h2 代替k个独立的哈希函数
+    def _positions(self, fp):
+        h1 = int.from_bytes(fp[:8], 'big')
+        h2 = int.from_bytes(fp[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.bit_size for i in range(self.hash_count)]
+
+    def request_seen(self, request):
+        fp = request_fingerprint(request)
+        if fp is None:
+            return False
+        seen = True
+        for position in self._positions(fp):
+            byte_index, bit = divmod(position, 8)
+            if not self.bits[byte_index] & (1 << bit):
+                seen = False
+                self.bits[byte_index] |= 1 << bit
+        if not seen:
+            self.count += 1
+        return seen
+
+    #位数组大小固定，直接复制完整状态，复制的开销远小于序列化
+    def take_changes(self):
+        return True, (self.count, bytes(self.bits))
+
+    def apply_changes(self, state):
+        count, bits = state
+        #CAPACITY或ERROR_RATE已改变时位数组大小不同，无法恢复
+        if len(bits) != len(self.bits):
+            raise ValueError('saved bloom filter size does not match')
+        self.count, self.bits = count, bytearray(bits)
+
+    def __len__(self):
+        return self.count
+
+
+#根据配置创建去重器，BACKEND为None时不去重
+def get_dupefilter(dupefilter_config=None):
+    config = dict(DUPEFILTER_CONFIG, **(dupefilter_config or {}))
+    backend = config['BACKEND']
+    if backend is None:
+        return None
+    if backend == 'set':
+        return SetDupeFilter()
+    if backend == 'bloom':
+        return BloomDupeFilter(capacity=config['CAPACITY'], error_rate=config['ERROR_RATE'])
+    raise ValueError('%s dupefilter backend is not supported' % backend)
@@ -0,0 +1,122 @@
+#-*-coding:utf8-*-
+
+import codecs
+import re
+
+from lxml import etree
+
+#可选的编码检测库(pip install cchardet或chardet)，未声明为依赖，需另行安装；
+#均未安装时，未声明编码且不是utf-8的响应按cp1252(与浏览器的默认编码一致)解码
+try:
+    import cchardet as chardet
+except ImportError:
+    try:
+        import chardet
+    except ImportError:
+        chardet = None
+
+#在响应体开头多少字节内查找<meta charset>
+META_SEARCH_SIZE = 4096
+#只检查响应体开头多少字节能否按utf-8解码，编码检测库也只检测这部分
+DETECT_SIZE = 65536
+
+_CHARSET_RE = re.compile(r'charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+_META_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+
+#与浏览器一致，按常见的超集解码，避免声明的编码与实际使用的字符不符时出现乱码
+_SUPERSETS = {
+    'ascii': 'cp1252',
+    'latin-1': 'cp1252',
+    'iso8859-1': 'cp1252',
+    'gb2312': 'gb18030',
+    'gbk': 'gb18030',
+}
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+#按编码缓存的lxml解析器
+_parsers = {}
+
+
+#返回规范化的编码名，无法识别时返回None
+def normalize_encoding(name):
+    if not name:
+        return None
+    try:
+        name = codecs.lookup(name).name
+    except LookupError:
+        return None
+    return _SUPERSETS.get(name, name)
+
+
+#从Content-Type中获取编码
+def encoding_from_content_type(content_type):
+    match = _CHARSET_RE.search(content_type or '')
+    return normalize_encoding(match.group(1)) if match else None
+
+
+def encoding_from_bom(data):
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return encoding
+    return None
+
+
+#从开头的<meta charset="...">或<meta http-equiv="Content-Type" content="...; charset=...">中获取编码
+def encoding_from_meta(data, search_size=META_SEARCH_SIZE):
+    match = _META_RE.search(data, 0, search_size)
+    if match is None:
+        return None
+    encoding = normalize_encoding(match.group(1).decode('ascii', 'ignore'))
+    #字节流已按ASCII兼容编码解析出meta，声明的utf-16等实际不可能，同浏览器按utf-8处理
+    if encoding is not None and encoding.startswith(('utf-16', 'utf-32')):
+        return 'utf-8'
+    return encoding
+
+
+#开头的detect_size字节能否按utf-8解码，截断处不完整的多字节字符不算错误
+def is_utf8(data, detect_size=DETECT_SIZE):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        decoder.decode(data[:detect_size], final=len(data) <= detect_size)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+#按以下顺序确定响应体的编码，前面的方法只需检查很少的字节：
+#Content-Type的charset、BOM、开头的<meta charset>、开头能否按utf-8解码、编码检测库(可选)，最后默认为cp1252
+def detect_encoding(data, content_type=None):
+    encoding = encoding_from_content_type(content_type) or encoding_from_bom(data) or encoding_from_meta(data)
+    if encoding is not None:
+        return encoding
+    if is_utf8(data):
+        return 'utf-8'
+    if chardet is not None:
+        encoding = normalize_encoding(chardet.detect(data[:DETECT_SIZE]).get('encoding'))
+        if encoding is not None:
+            return encoding
+    return 'cp1252'
+
+
+#直接由字节及编码解析为etree，不必先解码为字符串；libxml2不支持的编码解码后再解析
+def parse_html(data, encoding=None):
+    if encoding is None:
+        return etree.HTML(data)
+    parser = _parsers.get(encoding)
+    if parser is None:
+        try:
+            #libxml2使用iconv的编码名，如euc-kr而不是euc_kr
+            parser = etree.HTMLParser(encoding=encoding.replace('_', '-'))
+        except LookupError:
+            parser = False
+        _parsers[encoding] = parser
+    if parser is False:
+        return etree.HTML(data.decode(encoding, 'replace'))
+    return etree.HTML(data, parser=parser)
@@ -1,6 +1,7 @@
 #-*- coding:utf8-*-
 
 from lxml import etree
+from lxml.cssselect import CSSSelector
 
 #基类
 class BaseField(object):
@@ -9,6 +10,20 @@ class BaseField(object):
         self.css_select = css_select
         self.xpath_select = xpath_select
         self.default = default
+        #预编译的选择器，由ItemMeta在创建Item类时编译
+        self.selector = None
+
+    #将css_select或xpath_select编译为可重复使用的CSSSelector/XPath对象，
+    #避免每次提取时重新将css转换为xpath并编译
+    def compile(self):
+        if self.selector is None:
+            if self.css_select:
+                self.selector = CSSSelector(self.css_select)
+            elif self.xpath_select:
+                self.selector = etree.XPath(self.xpath_select)
+            else:
+                raise ValueError("%s field: css_select or xpath_select is expected" % self.__class__.__name__)
+        return self.selector
 
 #获取文本
 class TextField(BaseField):
@@ -17,13 +32,8 @@ class TextField(BaseField):
 
     #提取数据
     def extract_value(self, html, is_source=False):
-        #判断解析类型
-        if self.css_select:
-            value = html.cssselect(self.css_select)
-        elif self.xpath_select:
-            value = html.xpath(self.xpath_select)
-        else:
-            raise ValueError("%s field: css_select or xpath_select is respected"% self.__class__.__name__)
+        #使用预编译的选择器提取
+        value = (self.selector or self.compile())(html)
         if is_source:
             return value
         #判断提取的节点是否为list且元素个数为1,此处的value可以是公共节点target_item，或单个节点
@@ -53,13 +63,9 @@ class AttrField(BaseField):
         Use css_select or re_select to extract a field value
         :return:
         """
+        value = (self.selector or self.compile())(html)
         if self.css_select:
-            value = html.cssselect(self.css_select)
             value = value[0].get(self.attr, value) if len(value) == 1 else value
-        elif self.xpath_select:
-            value = html.xpath(self.xpath_select)
-        else:
-            raise ValueError('%s field: css_select or xpath_select is expected' % self.__class__.__name__)
         if is_source:
             return value
         if self.default is not None:
@@ -0,0 +1,380 @@
+#-*-coding:utf8-*-
+
+import asyncio
+import heapq
+import inspect
+import itertools
+import pickle
+import sqlite3
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ruia_study.utils.log import get_logger
+
+
+#去重状态增量保存时每条记录的指纹数
+DUPEFILTER_CHUNK_SIZE = 10000
+
+#各请求类构造参数的默认值，用于只保存与默认值不同的参数
+_init_defaults = {}
+
+
+def _get_init_defaults(request_cls):
+    defaults = _init_defaults.get(request_cls)
+    if defaults is None:
+        defaults = {
+            name: param.default for name, param in inspect.signature(request_cls.__init__).parameters.items()
+            if param.default is not inspect.Parameter.empty
+        }
+        _init_defaults[request_cls] = defaults
+    return defaults
+
+
+#队列中保存的轻量请求描述，只保存与默认值不同的构造参数及重试次数等运行状态，出队时再创建请求，
+#大量请求排队时不必为每个请求保留完整的Request对象；
+#请求由request_cls(**request.to_dict())还原，Request子类新增的构造参数需加入to_dict，
+#不属于构造参数的属性(如PyppeteerRequest.browser_pool)不会保留，需在出队后(如Spider.handle_request中)设置
+class RequestDescriptor:
+
+    __slots__ = ('request_cls', 'data', 'retry_count', 'request_session', 'frontier_id', 'enqueued_at')
+
+    def __init__(self, request):
+        defaults = _get_init_defaults(type(request))
+        self.request_cls = type(request)
+        self.data = {
+            name: value for name, value in request.to_dict().items()
+            if name not in defaults or value is not defaults[name] and value != defaults[name]
+        }
+        self.retry_count = request.retry_count
+        #请求自带的会话，未设置时由Spider使用共享会话
+        self.request_session = None if request.close_request_session else request.request_session
+        self.frontier_id = request.frontier_id
+        self.enqueued_at = time.monotonic()
+
+    def to_request(self):
+        request = self.request_cls(**self.data)
+        request.retry_count = self.retry_count
+        request.request_session = self.request_session
+        request.frontier_id = self.frontier_id
+        request.enqueued_at = self.enqueued_at
+        return request
+
+
+#同一令牌桶(域名)的排队请求，state为'ready'(可出队)或'waiting'(等待令牌)
+class _HostQueue:
+
+    __slots__ = ('bucket', 'heap', 'state', 'waiting_since', 'throttled')
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.heap = []
+        self.state = 'ready'
+        self.waiting_since = 0.0
+        #累计等待令牌的秒数，入队时记录当前值，出队时的差值即该请求因限速等待的时间
+        self.throttled = 0.0
+
+
+#按优先级及深度出队的请求队列，priority越大越先出队，优先级相同时
+#bfs策略深度小的先出队，dfs策略深度大的先出队，其余按入队顺序
+#队列中保存并出队RequestDescriptor，由Spider调用to_request还原为请求；
+#max_size为回调产生的请求排队的上限，由Spider按has_room暂停回调，入队本身不受限制，出队顺序始终按优先级
+#设置rate_limiter时按域名(令牌桶)分别排队，令牌不可用的域名的请求留在队列中，出队时才预定令牌，
+#其余域名的请求仍按优先级出队；没有可出队的请求时在最早的令牌可用时唤醒等待出队的工人
+class PriorityRequestQueue(asyncio.Queue):
+
+    def __init__(self, max_size=0, crawl_policy='bfs', rate_limiter=None, stats=None):
+        if crawl_policy not in ('bfs', 'dfs'):
+            raise ValueError('%s crawl policy is not supported' % crawl_policy)
+        self.depth_sign = 1 if crawl_policy == 'bfs' else -1
+        self.max_size = max_size
+        self.rate_limiter = rate_limiter
+        #记录每个请求因限速等待的时间
+        self.stats = stats
+        self._wakeup_handle, self._wakeup_at = None, None
+        #重试、恢复等内部入队不受max_size限制，故asyncio.Queue本身不限制长度
+        super().__init__()
+
+    #asyncio.Queue通过以下三个方法存取元素，PriorityQueue等子类也是如此实现
+    def _init(self, maxsize):
+        self._hosts = {}
+        #可出队域名的堆，按域名第一个请求的排序键排序，域名的第一个请求变化或域名转为等待后条目失效
+        self._ready = []
+        #等待令牌的域名的堆，按令牌可用时间排序
+        self._waiting = []
+        self._size = 0
+        self._counter = itertools.count()
+
+    def qsize(self):
+        return self._size
+
+    #是否没有可立即出队的请求，只在等待令牌的请求不计入
+    def empty(self):
+        return self._peek_host() is None
+
+    def _put(self, request):
+        sort_key = (-request.priority, self.depth_sign * request.depth, next(self._counter))
+        bucket = None if self.rate_limiter is None else self.rate_limiter.get_bucket(request.url)
+        host = self._hosts.get(bucket)
+        if host is None:
+            host = self._hosts[bucket] = _HostQueue(bucket)
+        heapq.heappush(host.heap, (sort_key, RequestDescriptor(request), host.throttled))
+        self._size += 1
+        #成为可出队域名的第一个请求时加入可出队堆
+        if host.state == 'ready' and host.heap[0][0] is sort_key:
+            heapq.heappush(self._ready, (sort_key, host))
+
+    def _get(self):
+        host = self._peek_host()
+        heapq.heappop(self._ready)
+        _, descriptor, throttled = heapq.heappop(host.heap)
+        self._size -= 1
+        if host.bucket is not None:
+            host.bucket.reserve()
+        if host.heap:
+            heapq.heappush(self._ready, (host.heap[0][0], host))
+        else:
+            del self._hosts[host.bucket]
+        if self.stats is not None:
+            self.stats.observe('throttle', host.throttled - throttled)
+        #asyncio.Queue只在入队时唤醒出队者，令牌可用的请求可能有多个，此处继续唤醒下一个
+        if self._getters and not self.empty():
+            self._wakeup_next(self._getters)
+        return descriptor
+
+    #请求出队后未发出(无法还原、请求中间件直接返回了响应或将其丢弃)时返还预定的令牌，
+    #令牌因此可用的等待域名立即转为可出队
+    def refund(self, url):
+        if self.rate_limiter is None:
+            return
+        bucket = self.rate_limiter.get_bucket(url)
+        bucket.refund()
+        host = self._hosts.get(bucket)
+        now = time.monotonic()
+        if host is not None and host.state == 'waiting' and bucket.ready_at(now) <= now:
+            self._set_ready(host, now)
+            self._wakeup_next(self._getters)
+
+    def _set_ready(self, host, now):
+        host.state = 'ready'
+        host.throttled += now - host.waiting_since
+        heapq.heappush(self._ready, (host.heap[0][0], host))
+
+    #返回第一个请求可出队的域名，令牌不可用的域名在此转为等待
+    def _peek_host(self):
+        now = time.monotonic()
+        #令牌可能因暂停(Retry-After)而推迟，转回可出队前重新检查
+        while self._waiting and self._waiting[0][0] <= now:
+            _, _, host = heapq.heappop(self._waiting)
+            if host.state != 'waiting':
+                continue
+            ready_at = host.bucket.ready_at(now)
+            if ready_at > now:
+                heapq.heappush(self._waiting, (ready_at, next(self._counter), host))
+            else:
+                self._set_ready(host, now)
+        while self._ready:
+            sort_key, host = self._ready[0]
+            if host.state != 'ready' or not host.heap or host.heap[0][0] is not sort_key:
+                heapq.heappop(self._ready)
+                continue
+            if host.bucket is not None:
+                ready_at = host.bucket.ready_at(now)
+                if ready_at > now:
+                    heapq.heappop(self._ready)
+                    host.state, host.waiting_since = 'waiting', now
+                    heapq.heappush(self._waiting, (ready_at, next(self._counter), host))
+                    continue
+            return host
+        self._schedule_wakeup()
+        return None
+
+    #在最早的令牌可用时唤醒一个等待出队的工人
+    def _schedule_wakeup(self):
+        if not self._waiting:
+            return
+        ready_at = self._waiting[0][0]
+        if self._wakeup_handle is not None:
+            if self._wakeup_at <= ready_at:
+                return
+            self._wakeup_handle.cancel()
+        self._wakeup_at = ready_at
+        self._wakeup_handle = asyncio.get_event_loop().call_later(max(ready_at - time.monotonic(), 0),
+                                                                  self._on_wakeup)
+
+    def _on_wakeup(self):
+        self._wakeup_handle = None
+        self._wakeup_next(self._getters)
+
+    #队列长度是否低于max_size，用于回调产生请求时的背压
+    def has_room(self):
+        return not self.max_size or self._size < self.max_size
+
+#将请求转换为可持久化的记录，爬虫自身的回调方法只保存方法名
+def request_to_record(request, spider):
+    data = request.to_dict()
+    callback = data.get('callback')
+    if callback is not None and getattr(callback, '__self__', None) is spider:
+        data['callback'] = callback.__name__
+    return pickle.dumps((type(request), data))
+
+
+#由记录还原请求，回调方法名从爬虫实例上获取
+def record_to_request(record, spider):
+    request_cls, data = pickle.loads(record)
+    if isinstance(data.get('callback'), str):
+        data['callback'] = getattr(spider, data['callback'])
+    return request_cls(**data)
+
+
+#基于SQLite的持久化队列，保存未完成的请求及去重状态，用于爬虫中断后继续爬取
+#写入先缓存在内存中，达到batch_size或每隔flush_interval秒批量写入；
+#写入及提交在单独的线程中按提交顺序执行，不阻塞事件循环，去重状态只保存上次保存后的变化
+class SqliteFrontierStore:
+
+    name = 'Frontier'
+
+    def __init__(self, path, batch_size=100, flush_interval=1, checkpoint_interval=60):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.logger = get_logger(name=self.name)
+        #连接只在启动时的加载及写入线程中使用，写入线程只有一个，保证写入顺序
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS requests (id INTEGER PRIMARY KEY, record BLOB)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS dupefilter (id INTEGER PRIMARY KEY, kind TEXT, state BLOB)')
+        self.conn.commit()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.next_id = (self.conn.execute('SELECT MAX(id) FROM requests').fetchone()[0] or 0) + 1
+        #待写入的记录及待删除的记录id
+        self.pending_inserts, self.pending_deletes = {}, []
+        #爬取全部完成后不再保存去重状态
+        self.finished = False
+
+    #是否有上次未完成的请求
+    def has_pending(self):
+        return self.conn.execute('SELECT 1 FROM requests LIMIT 1').fetchone() is not None
+
+    #按入队顺序加载上次未完成的请求
+    def load_requests(self, spider):
+        for row_id, record in self.conn.execute('SELECT id, record FROM requests ORDER BY id'):
+            try:
+                request = record_to_request(record, spider)
+            except Exception as e:
+                self.logger.error(f'<Restore request failed: {row_id} {e}>')
+                continue
+            request.frontier_id = row_id
+            yield request
+
+    #将上次保存的去重状态依次恢复到dupefilter中，去重器类型不同(如更换了BACKEND)时不恢复
+    def load_dupefilter(self, dupefilter):
+        if dupefilter is None:
+            return
+        for kind, state in self.conn.execute('SELECT kind, state FROM dupefilter ORDER BY id'):
+            if kind != type(dupefilter).__name__:
+                self.logger.warning(f'<Saved dupefilter state of {kind} ignored>')
+                return
+            try:
+                dupefilter.apply_changes(pickle.loads(state))
+            except ValueError as e:
+                self.logger.warning(f'<Saved dupefilter state ignored: {e}>')
+                return
+
+    #记录新入队的请求
+    def push(self, request, spider):
+        try:
+            record = request_to_record(request, spider)
+        except Exception as e:
+            #无法序列化的请求(如回调为lambda)只保存在内存队列中
+            self.logger.warning(f'<Request can not be persisted: {request} {e}>')
+            return
+        row_id = self.next_id
+        self.next_id += 1
+        #记录id保存在请求上，请求完成后据此删除记录
+        request.frontier_id = row_id
+        self.pending_inserts[row_id] = record
+        if len(self.pending_inserts) + len(self.pending_deletes) >= self.batch_size:
+            self.flush()
+
+    #请求完成后删除其记录，尚未写入的记录直接丢弃
+    def done(self, request):
+        row_id = request.frontier_id
+        if row_id is None:
+            return
+        request.frontier_id = None
+        if self.pending_inserts.pop(row_id, None) is None:
+            #已交给写入线程的记录在写入后才删除，写入线程按提交顺序执行
+            self.pending_deletes.append(row_id)
+            if len(self.pending_inserts) + len(self.pending_deletes) >= self.batch_size:
+                self.flush()
+
+    #将缓存的写入交给写入线程
+    def flush(self):
+        if not self.pending_inserts and not self.pending_deletes:
+            return
+        self._submit(self._write_requests, self.pending_inserts, self.pending_deletes)
+        self.pending_inserts, self.pending_deletes = {}, []
+
+    def _write_requests(self, inserts, deletes):
+        with self.conn:
+            self.conn.executemany('INSERT INTO requests (id, record) VALUES (?, ?)', inserts.items())
+            self.conn.executemany('DELETE FROM requests WHERE id = ?', ((row_id,) for row_id in deletes))
+
+    #保存去重状态，事件循环中只取出上次保存后的变化，序列化及写入在写入线程中进行
+    def checkpoint(self, dupefilter):
+        self.flush()
+        if dupefilter is not None and not self.finished:
+            full, state = dupefilter.take_changes()
+            if full or state:
+                self._submit(self._write_dupefilter, type(dupefilter).__name__, full, state)
+
+    #full为True时state为完整状态，替换之前保存的全部状态，否则state为新增部分的列表，追加保存；
+    #列表分块序列化，单次序列化不会长时间占用GIL而阻塞事件循环
+    def _write_dupefilter(self, kind, full, state):
+        if full:
+            chunks = [state]
+        else:
+            chunks = (state[i:i + DUPEFILTER_CHUNK_SIZE] for i in range(0, len(state), DUPEFILTER_CHUNK_SIZE))
+        with self.conn:
+            if full:
+                self.conn.execute('DELETE FROM dupefilter')
+            for chunk in chunks:
+                self.conn.execute('INSERT INTO dupefilter (kind, state) VALUES (?, ?)',
+                                  (kind, pickle.dumps(chunk, protocol=pickle.HIGHEST_PROTOCOL)))
+
+    def _submit(self, func, *args):
+        self.executor.submit(func, *args).add_done_callback(self._check_write)
+
+    def _check_write(self, future):
+        if future.exception() is not None:
+            self.logger.error(f'<Write frontier failed: {future.exception()}>')
+
+    #定时批量写入及保存去重状态，由Spider作为后台任务运行
+    async def run(self, spider):
+        elapsed = 0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            elapsed += self.flush_interval
+            if elapsed >= self.checkpoint_interval:
+                elapsed = 0
+                self.checkpoint(spider.dupefilter)
+            else:
+                self.flush()
+
+    #爬取全部完成后清空，下次启动时重新从start_urls开始
+    def clear(self):
+        self.finished = True
+        self.pending_inserts, self.pending_deletes = {}, []
+        self._submit(self._clear)
+
+    def _clear(self):
+        with self.conn:
+            self.conn.execute('DELETE FROM requests')
+            self.conn.execute('DELETE FROM dupefilter')
+
+    #写入剩余的记录及去重状态，等待写入线程完成后关闭
+    def close(self, dupefilter=None):
+        self.checkpoint(dupefilter)
+        self.executor.shutdown(wait=True)
+        self.conn.close()
@@ -1,11 +1,25 @@
 #-*-coding:utf8-*-
 
-from inspect import iscoroutinefunction
+import asyncio
+
+from inspect import getattr_static, iscoroutinefunction
 from lxml import etree
 from typing import Any
 
-from ruia_study.field import BaseField
-from ruia.request import Request
+from ruia_study.encoding import parse_html
+from ruia_study.fields import BaseField
+from ruia_study.request import Request
+
+
+#将提取结果转换为可在进程间传递的普通对象，节点转换为html字符串
+def _to_plain(value):
+    if isinstance(value, etree._Element):
+        return etree.tostring(value, encoding='unicode')
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [_to_plain(i) for i in value]
+    return value
 
 
 #创建自定义元类，必须继承type,用于控制生成类实例的过程
@@ -13,13 +27,25 @@ class ItemMeta(type):
 
     #继承元类，__new__方法的参数为name，bases，attrs
     def __new__(cls, name, bases, attrs):
-        #将自定义的符合要求的字段传递到生成类实例过程中
-        __fields = dict({
-            (field_name, attrs.pop(field_name)) for field_name, object in list(attrs.items())
+        #将自定义的符合要求的字段传递到生成类实例过程中，按定义顺序保存
+        __fields = {
+            field_name: attrs.pop(field_name) for field_name, object in list(attrs.items())
                 if isinstance(object, BaseField)
-        })
+        }
+        #创建类时预编译各字段的选择器，提取时直接使用
+        for field in __fields.values():
+            field.compile()
         attrs['__fields'] = __fields
         new_class = type.__new__(cls, name, bases, attrs)
+        #提取计划：按顺序保存字段名、字段、clean_方法及其是否为协程，解析时无需再查找
+        #clean_方法保存类属性的原始值，调用时按实例绑定，staticmethod、classmethod同样适用
+        plan = tuple(
+            (field_name, field, getattr_static(new_class, clean_name, None),
+             iscoroutinefunction(getattr(new_class, clean_name, None)))
+            for field_name, field in __fields.items()
+            for clean_name in ['clean_%s' % field_name]
+        )
+        setattr(new_class, '__plan', plan)
         return new_class
 
 
@@ -36,7 +62,8 @@ class Item(metaclass=ItemMeta): #必须传递metaclass才能使用自定义的
         if not html:
             request = Request(url, **kwargs)
             response = await request.fetch()
-            html = response.html
+            #由响应体按检测到的编码直接解析
+            return response.html_etree
         return etree.HTML(html)
 
     @classmethod #获取包含单个数据的item实例
@@ -51,9 +78,14 @@ class Item(metaclass=ItemMeta): #必须传递metaclass才能使用自定义的
     @classmethod #获取含多字段数据的item实例
     async def get_items(cls, *, html:str='', url: str ='',html_etree:etree._Element =None,**kwargs) -> list:
         if html_etree is None:
-            etree_result = await cls._get_html(htm, url, **kwargs)
+            etree_result = await cls._get_html(html, url, **kwargs)
         else:
             etree_result = html_etree
+        #先同步提取所有节点的数据，再并发执行所有节点的协程clean_方法
+        return await cls._parse_nodes(cls._get_target_nodes(etree_result))
+
+    @classmethod #获取target_item对应的所有节点
+    def _get_target_nodes(cls, etree_result):
         #必须设置target字段，target为所有字段的共同部分
         #即之后设置的字段都是在target字段为基础上的
         items_field = getattr(cls, '__fields', {}).get('target_item', None)
@@ -61,13 +93,7 @@ class Item(metaclass=ItemMeta): #必须传递metaclass才能使用自定义的
             #此处is_source=True，表示直接提取该节点就返回
             items = items_field.extract_value(etree_result, is_source=True)
             if items:
-                #将目标节点传入解析方法中并提取数据
-                tasks = [cls._parse_html(etree_result=i) for i in items]
-                all_items = []
-                #遍历任务列表并执行解析任务最后返回含数据的item实例
-                for task in tasks:
-                    all_items.append(await task)
-                return all_items
+                return items
             else:
                 raise ValueError("Get target_item's value error!")
         else:
@@ -77,26 +103,66 @@ class Item(metaclass=ItemMeta): #必须传递metaclass才能使用自定义的
     @classmethod #解析数据并返回item实例
     async def _parse_html(cls, etree_result:etree._Element) -> object:
         #确保传入etree._Element对象
-        if etree_result is None or not isinstance(etree.result, etree._Element):
+        if etree_result is None or not isinstance(etree_result, etree._Element):
             raise ValueError("etree._Element is expected")
+        return (await cls._parse_nodes([etree_result]))[0]
+
+    @classmethod #按提取计划解析多个节点，协程clean_方法在所有节点提取完后并发执行
+    async def _parse_nodes(cls, nodes) -> list:
+        plan = getattr(cls, '__plan')
+        all_items = [cls._extract_node(node, plan) for node in nodes]
+        return await cls._run_async_clean(all_items, plan)
+
+    @classmethod #同步提取单个节点并执行非协程的clean_方法，协程clean_方法的字段先保存原始值
+    def _extract_node(cls, node, plan):
         item_ins = cls()
-        #根据自定义的字段解析数据
-        for field_name, field_value in getattr(item_ins, '__fields', {}).items():
+        results = item_ins.results
+        for field_name, field, clean_method, is_coroutine in plan:
+            value = field.extract_value(node)
             #对自定义字段数据进行处理，相当于scrapy的itempipeline功能
-            clean_method = getattr(item_ins, 'clean_%s' % field_name, None)
-            #提取数据，若定义了提取方法则调用，否则返回原数据值
-            value = field_value.extract_value(etree_result) if isinstance(field_value, BaseField) else field_value
-            if clean_method is not None:
-                #若为协程，则await
-                if iscoroutinefunction(clean_method):
-                    value = await clean_method(value)
-                else:
-                    value = clean_method(value)
+            if clean_method is not None and not is_coroutine:
+                value = clean_method.__get__(item_ins, cls)(value)
             #将字段提取方法设置为真实数据
             setattr(item_ins, field_name, value)
-            item_ins.results[field_name] = value
+            results[field_name] = value
         return item_ins
 
+    @classmethod #并发执行所有item实例的协程clean_方法并覆盖原始值
+    async def _run_async_clean(cls, all_items, plan):
+        pending = [
+            (item_ins, field_name, clean_method.__get__(item_ins, cls)(item_ins.results[field_name]))
+            for item_ins in all_items
+            for field_name, _, clean_method, is_coroutine in plan if is_coroutine
+        ]
+        if pending:
+            values = await asyncio.gather(*(coro for _, _, coro in pending))
+            for (item_ins, field_name, _), value in zip(pending, values):
+                setattr(item_ins, field_name, value)
+                item_ins.results[field_name] = value
+        return all_items
+
+    @classmethod #在进程池中调用，解析html并返回可序列化的结果字典列表，协程clean_方法不在此执行
+    #html为响应体字节时按encoding直接解析
+    def extract_results(cls, html, many=True, encoding=None) -> list:
+        etree_result = parse_html(html, encoding)
+        nodes = cls._get_target_nodes(etree_result) if many else [etree_result]
+        plan = getattr(cls, '__plan')
+        return [
+            {field_name: _to_plain(value) for field_name, value in cls._extract_node(node, plan).results.items()}
+            for node in nodes
+        ]
+
+    @classmethod #由extract_results返回的结果字典创建item实例，并执行协程clean_方法
+    async def from_results(cls, results_list) -> list:
+        all_items = []
+        for results in results_list:
+            item_ins = cls()
+            for field_name, value in results.items():
+                setattr(item_ins, field_name, value)
+            item_ins.results = results
+            all_items.append(item_ins)
+        return await cls._run_async_clean(all_items, getattr(cls, '__plan'))
+
 
     def __str__(self):
-        return f'<Item {self.results}>'
\ No newline at end of file
+        return f'<Item {self.results}>'
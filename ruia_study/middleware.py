@@ -2,6 +2,37 @@
 
 from collections import deque #双端队列，及队列前后均可操作
 from functools import wraps
+from inspect import iscoroutinefunction
+
+
+#中间件返回的信号
+class _Signal:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+#请求中间件返回DROP时丢弃该请求，不发起请求也不执行回调
+DROP = _Signal('DROP')
+
+
+#响应中间件返回Reschedule时不执行回调，延迟delay秒后重新请求，计入重试次数；
+#delay为None时按重试策略的退避时间
+class Reschedule:
+
+    def __init__(self, delay=None):
+        self.delay = delay
+
+    def __repr__(self):
+        return f'Reschedule(delay={self.delay})'
+
+
+def _is_coroutine_middleware(middleware):
+    return iscoroutinefunction(middleware) or iscoroutinefunction(getattr(middleware, '__call__', None))
+
 
 class Middleware:
 
@@ -42,6 +73,14 @@ class Middleware:
 
         return register_middleware()
 
+    #检查所有中间件均为协程函数，返回请求中间件及响应中间件的元组，由Spider初始化时调用，
+    #之后再注册的中间件不影响已创建的Spider
+    def compile(self):
+        for middleware in list(self.request_middleware) + list(self.response_middleware):
+            if not _is_coroutine_middleware(middleware):
+                raise ValueError('Middleware must be a coroutine function: %r' % (middleware,))
+        return tuple(self.request_middleware), tuple(self.response_middleware)
+
     #将多个中间件的请求中间件和响应中间件分别合并
     def __add__(self, other):
         new_middleware = Middleware()
@@ -0,0 +1,30 @@
+#-*-coding:utf8-*-
+
+import asyncio
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+
+#在子进程中执行，item_cls需为模块级别定义的类以便传递给子进程
+def _extract_results(item_cls, html, many, encoding):
+    return item_cls.extract_results(html, many=many, encoding=encoding)
+
+
+#解析进程池，将html解析及Item字段提取放到子进程中执行，不阻塞事件循环且可利用多核，
+#进程数与请求并发数相互独立
+class ParsePool:
+
+    def __init__(self, max_workers=None):
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    #在子进程中提取结果字典，回到事件循环后创建item实例并执行协程clean_方法；
+    #html可以是响应体字节及其编码，子进程直接解析字节，不必在事件循环中解码
+    async def get_items(self, item_cls, html, many=True, encoding=None) -> list:
+        loop = asyncio.get_event_loop()
+        results_list = await loop.run_in_executor(self.executor,
+                                                  partial(_extract_results, item_cls, html, many, encoding))
+        return await item_cls.from_results(results_list)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
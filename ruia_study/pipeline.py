@@ -0,0 +1,239 @@
+#-*-coding:utf8-*-
+
+import asyncio
+import csv
+import json
+import sqlite3
+
+from inspect import isawaitable
+
+from ruia_study.utils.log import get_logger
+
+
+#将item转换为字典，Item实例使用其results
+def item_to_dict(item):
+    results = getattr(item, 'results', item)
+    if not isinstance(results, dict):
+        raise TypeError(f'Item or dict is expected, got {type(item).__name__}')
+    return results
+
+
+#多进程运行时每个进程写入单独的文件
+def _shard_path(path, shard_id):
+    return path if shard_id is None else f'{path}.{shard_id}'
+
+
+#输出目标，open、write、close均在线程池中执行，write每次写入一批item字典
+class Sink:
+
+    def open(self, shard_id=None):
+        pass
+
+    def write(self, items):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+#每行一个json对象
+class JsonLinesSink(Sink):
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self.file = None
+
+    def open(self, shard_id=None):
+        self.file = open(_shard_path(self.path, shard_id), 'a', encoding=self.encoding)
+
+    def write(self, items):
+        self.file.write(''.join(json.dumps(item, ensure_ascii=False, default=str) + '\n' for item in items))
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+#fieldnames为None时使用第一个item的字段，文件为空时写入表头，多余的字段忽略
+class CsvSink(Sink):
+
+    def __init__(self, path, fieldnames=None, encoding='utf-8'):
+        self.path = path
+        self.fieldnames = fieldnames
+        self.encoding = encoding
+        self.file = None
+        self.writer = None
+
+    def open(self, shard_id=None):
+        self.file = open(_shard_path(self.path, shard_id), 'a', encoding=self.encoding, newline='')
+
+    def write(self, items):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames or list(items[0]), extrasaction='ignore')
+            if self.file.tell() == 0:
+                self.writer.writeheader()
+        self.writer.writerows(items)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+#写入SQLite表，表不存在时按第一个item的字段创建，非字符串及数字的值以json保存
+class SqliteSink(Sink):
+
+    def __init__(self, path, table='items'):
+        self.path = path
+        self.table = table
+        self.conn = None
+        self.columns = None
+
+    def open(self, shard_id=None):
+        self.conn = sqlite3.connect(_shard_path(self.path, shard_id), check_same_thread=False)
+
+    @staticmethod
+    def _to_value(value):
+        if value is None or isinstance(value, (str, int, float, bytes)):
+            return value
+        return json.dumps(value, ensure_ascii=False, default=str)
+
+    def write(self, items):
+        if self.columns is None:
+            self.columns = [row[1] for row in self.conn.execute(f'PRAGMA table_info("{self.table}")')]
+            if not self.columns:
+                self.columns = list(items[0])
+                self.conn.execute('CREATE TABLE "%s" (%s)' % (self.table, ', '.join(f'"{c}"' for c in self.columns)))
+        sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % (
+            self.table, ', '.join(f'"{c}"' for c in self.columns), ', '.join('?' for _ in self.columns))
+        self.conn.executemany(sql, [[self._to_value(item.get(c)) for c in self.columns] for item in items])
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+#item管道，回调中yield的Item或字典先放入有界缓冲区，由后台任务依次经过processors处理后
+#按batch_size或flush_interval批量写入sinks；缓冲区满时回调在yield处等待，爬取随之减速
+#processor为processor(item, spider)的函数或协程函数，返回处理后的item，返回None时丢弃该item
+class Pipeline:
+
+    name = 'Pipeline'
+
+    def __init__(self, processors=(), sinks=(), *, batch_size=100, flush_interval=1, max_buffer=1000):
+        self.processors = list(processors)
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.logger = get_logger(name=self.name)
+        self.queue = None
+        self.batch = []
+        #正在写入的批次，run被取消时仍继续写入，由close等待其完成
+        self.flushing = None
+        self.spider = None
+        self.written_counts, self.dropped_counts = 0, 0
+
+    async def open(self, spider):
+        self.spider = spider
+        self.queue = asyncio.Queue(maxsize=self.max_buffer)
+        shard_id = spider.shard.shard_id if spider.shard is not None else None
+        loop = asyncio.get_event_loop()
+        for sink in self.sinks:
+            await loop.run_in_executor(None, sink.open, shard_id)
+        asyncio.ensure_future(self.run())
+
+    #由Spider调用，缓冲区满时等待
+    async def put(self, item):
+        await self.queue.put(item)
+
+    #等待已放入的item全部写入
+    async def join(self):
+        await self.queue.join()
+
+    async def _process(self, item):
+        for processor in self.processors:
+            item = processor(item, self.spider)
+            if isawaitable(item):
+                item = await item
+            if item is None:
+                self.dropped_counts += 1
+                return None
+        return item_to_dict(item)
+
+    #取出当前批次在线程池中依次写入各sink，stop取消run时线程中的写入不会中断，
+    #shield使写入继续完成，close等待该写入而不是再次写入，避免sink收到重复的item
+    async def _flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+        loop = asyncio.get_event_loop()
+        self.flushing = loop.run_in_executor(None, self._write, batch)
+        await asyncio.shield(self.flushing)
+
+    def _write(self, batch):
+        for sink in self.sinks:
+            try:
+                sink.write(batch)
+            except Exception as e:
+                self.logger.error(f'<Sink {type(sink).__name__} write error: {e}>')
+        self.written_counts += len(batch)
+
+    #从缓冲区取出item，第一个item进入批次后最多等待flush_interval秒
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            taken = 0
+            try:
+                item = await self.queue.get()
+                taken = 1
+                deadline = loop.time() + self.flush_interval
+                while True:
+                    try:
+                        item = await self._process(item)
+                    except Exception as e:
+                        self.dropped_counts += 1
+                        self.logger.error(f'<Pipeline process error: {e}>')
+                        item = None
+                    if item is not None:
+                        self.batch.append(item)
+                    if len(self.batch) >= self.batch_size:
+                        break
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    taken += 1
+                await self._flush()
+            finally:
+                for _ in range(taken):
+                    self.queue.task_done()
+
+    #爬虫停止时调用，处理缓冲区中剩余的item并写入后关闭sinks
+    async def close(self):
+        if self.flushing is not None:
+            await self.flushing
+        if self.queue is not None:
+            while not self.queue.empty():
+                try:
+                    item = await self._process(self.queue.get_nowait())
+                except Exception as e:
+                    self.dropped_counts += 1
+                    self.logger.error(f'<Pipeline process error: {e}>')
+                    continue
+                if item is not None:
+                    self.batch.append(item)
+            await self._flush()
+        loop = asyncio.get_event_loop()
+        for sink in self.sinks:
+            await loop.run_in_executor(None, sink.close)
+        self.logger.info(f'Items written: {self.written_counts}, dropped: {self.dropped_counts}')
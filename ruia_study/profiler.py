@@ -0,0 +1,153 @@
+#-*-coding:utf8-*-
+
+import asyncio
+import cProfile
+import heapq
+import io
+import itertools
+import pstats
+import time
+import types
+
+from collections import defaultdict
+
+from ruia_study.stats import Histogram
+from ruia_study.utils.log import get_logger
+
+#事件循环延迟直方图的桶上界，单位为秒
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+#一次回调或中间件调用的计时：blocking为占用事件循环的总时间，即协程每一步同步执行的耗时之和，
+#不含其中await等待IO的时间；longest为最长的一步，即该调用造成的最大事件循环延迟
+class CallRecord:
+
+    __slots__ = ('kind', 'name', 'url', 'start', 'blocking', 'longest', 'profile')
+
+    def __init__(self, kind, name, url, profile=None):
+        self.kind = kind
+        self.name = name
+        self.url = url
+        self.start = time.monotonic()
+        self.blocking = 0.0
+        self.longest = 0.0
+        self.profile = profile
+
+
+#逐步驱动协程并记录每一步的耗时，开启cProfile时只在这些步骤中采集，不包括同时运行的其它任务
+@types.coroutine
+def _timed(coro, record):
+    value, error = None, None
+    while True:
+        if record.profile is not None:
+            record.profile.enable()
+        start = time.perf_counter()
+        try:
+            if error is None:
+                future = coro.send(value)
+            else:
+                future = coro.throw(error)
+        except StopIteration as e:
+            return e.value
+        finally:
+            elapsed = time.perf_counter() - start
+            if record.profile is not None:
+                record.profile.disable()
+            record.blocking += elapsed
+            record.longest = max(record.longest, elapsed)
+        try:
+            value, error = (yield future), None
+        except BaseException as e:
+            value, error = None, e
+
+
+#事件循环延迟监控及慢回调、慢中间件分析，由Spider按PROFILE_CONFIG创建，结果在stats的extra['profile']中
+class CallProfiler:
+
+    name = 'Profiler'
+
+    def __init__(self, lag_interval=0.1, slow_threshold=0.1, top_n=10, use_cprofile=False, profile_lines=20):
+        self.lag_interval = lag_interval
+        self.slow_threshold = slow_threshold
+        self.top_n = top_n
+        self.use_cprofile = use_cprofile
+        self.profile_lines = profile_lines
+        self.logger = get_logger(name=self.name)
+        self.loop_lag = Histogram(LAG_BUCKETS)
+        self.max_lag = 0.0
+        #按"类型:名称"统计的调用次数、占用事件循环的总时间、最长一步的耗时及超过阈值的次数
+        self.calls = defaultdict(lambda: {'count': 0, 'blocking': 0.0, 'longest': 0.0, 'slow_counts': 0})
+        #最慢的top_n次调用，小顶堆
+        self.slowest = []
+        self._counter = itertools.count()
+
+    def _name(self, func):
+        return getattr(func, '__qualname__', None) or repr(func)
+
+    #开始一次调用的计时，func为回调或中间件
+    def begin(self, kind, func, url):
+        return CallRecord(kind, self._name(func), url, cProfile.Profile() if self.use_cprofile else None)
+
+    #执行awaitable(协程或协程生成器的__anext__())并将耗时计入record
+    async def run(self, record, awaitable):
+        return await _timed(awaitable.__await__(), record)
+
+    #结束一次调用的计时，超过阈值时输出警告，并保留最慢的top_n次调用
+    def end(self, record):
+        key = f'{record.kind}:{record.name}'
+        calls = self.calls[key]
+        calls['count'] += 1
+        calls['blocking'] += record.blocking
+        calls['longest'] = max(calls['longest'], record.longest)
+        if record.longest >= self.slow_threshold:
+            calls['slow_counts'] += 1
+            self.logger.warning(f'<Slow {record.kind} {record.name}: blocked the event loop for {record.longest:.3f}s '
+                                f'({record.blocking:.3f}s in total) {record.url}>')
+        if self.top_n and (len(self.slowest) < self.top_n or record.blocking > self.slowest[0][0]):
+            entry = {
+                'kind': record.kind,
+                'name': record.name,
+                'url': record.url,
+                'blocking': record.blocking,
+                'longest': record.longest,
+                'wall': time.monotonic() - record.start,
+            }
+            #只为进入top_n的调用生成cProfile报告
+            if record.profile is not None:
+                entry['profile'] = self._format_profile(record.profile)
+            item = (record.blocking, next(self._counter), entry)
+            if len(self.slowest) < self.top_n:
+                heapq.heappush(self.slowest, item)
+            else:
+                heapq.heapreplace(self.slowest, item)
+
+    async def call(self, kind, func, url, awaitable):
+        record = self.begin(kind, func, url)
+        try:
+            return await self.run(record, awaitable)
+        finally:
+            self.end(record)
+
+    def _format_profile(self, profile):
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats('cumulative').print_stats(self.profile_lines)
+        return output.getvalue()
+
+    #按lag_interval定时sleep，实际唤醒时间比预期晚的部分即为事件循环延迟，由Spider作为后台任务运行
+    async def monitor_loop_lag(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(loop.time() - start - self.lag_interval, 0)
+            self.loop_lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.slow_threshold:
+                self.logger.warning(f'<Event loop lag: {lag:.3f}s>')
+
+    def to_dict(self):
+        return {
+            'loop_lag': dict(self.loop_lag.to_dict(), max=self.max_lag),
+            'calls': dict(self.calls),
+            'slowest': [entry for _, _, entry in sorted(self.slowest, reverse=True)],
+        }
@@ -0,0 +1,105 @@
+#-*-coding:utf8-*-
+
+import time
+
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from ruia_study.settings import RATE_LIMIT_CONFIG
+
+
+#令牌桶，按rate(个/秒)生成令牌，最多积攒burst个，rate为0时不限速
+class TokenBucket:
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        #上次补充令牌的时间，暂停时会被设置为将来的某个时间点
+        self.updated_at = time.monotonic()
+
+    #预定一个令牌并返回需等待的秒数，令牌可以透支，保证等待者按先后顺序放行
+    def reserve(self):
+        now = time.monotonic()
+        if not self.rate:
+            return self.updated_at - now
+        if now > self.updated_at:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+        self.tokens -= 1
+        wait = self.updated_at - now
+        if self.tokens < 0:
+            wait += -self.tokens / self.rate
+        return wait
+
+    #下一个令牌可用的时间，不预定令牌，已可用时返回now
+    def ready_at(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if not self.rate:
+            return self.updated_at
+        if now < self.updated_at:
+            return self.updated_at + max(1 - self.tokens, 0) / self.rate
+        tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        #容许浮点误差，否则按ready_at唤醒时可能仍差极小的一部分令牌
+        return now if tokens >= 1 - 1e-9 else now + (1 - tokens) / self.rate
+
+    #返还预定的令牌，用于预定后未发出的请求
+    def refund(self):
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    #暂停发放令牌seconds秒，用于429及Retry-After
+    def pause(self, seconds):
+        now = time.monotonic()
+        if now > self.updated_at:
+            self.updated_at = now
+        self.tokens = min(self.tokens, 0)
+        self.updated_at = max(self.updated_at, now + seconds)
+
+
+#按域名限速，每个域名一个令牌桶，某个域名的等待不会影响其它域名
+class DomainRateLimiter:
+
+    def __init__(self, rate_limit_config=None, delay=0):
+        self.config = dict(RATE_LIMIT_CONFIG, **(rate_limit_config or {}))
+        #兼容REQUEST_CONFIG['DELAY']，未设置RATE时按每DELAY秒一个请求限速
+        if not self.config['RATE'] and delay > 0:
+            self.config['RATE'] = 1 / delay
+        self.buckets = {}
+
+    #获取域名对应的令牌桶
+    def get_bucket(self, url):
+        domain = urlparse(url).hostname or ''
+        if domain not in self.buckets:
+            domain_config = dict(self.config, **self.config['DOMAINS'].get(domain, {}))
+            self.buckets[domain] = TokenBucket(domain_config['RATE'], domain_config['BURST'])
+        return self.buckets[domain]
+
+    #预定该域名的一个请求名额，返回需等待的秒数
+    def reserve(self, url):
+        return self.get_bucket(url).reserve()
+
+    #根据响应状态码及Retry-After调整该域名的发放节奏
+    def feedback(self, url, status, headers=None):
+        if not self.config['RETRY_AFTER'] or status not in (429, 503):
+            return
+        delay = parse_retry_after((headers or {}).get('Retry-After'))
+        if delay is None:
+            if status != 429:
+                return
+            delay = self.config['BACKOFF']
+        self.get_bucket(url).pause(min(delay, self.config['MAX_RETRY_AFTER']))
+
+
+#解析Retry-After，支持秒数和HTTP日期两种格式
+def parse_retry_after(value):
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0)
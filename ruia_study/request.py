@@ -1,37 +1,74 @@
 #-*-coding:utf8-*-
 
-import asyncio
 import aiohttp
 import async_timeout
+import tempfile
+import time
 
 from inspect import iscoroutinefunction
-from types import  AsyncGeneratorType
+from types import  AsyncGeneratorType, MappingProxyType
 from typing import Tuple
 
 from ruia_study.response import Response
-from ruia_study.utils import get_logger
+from ruia_study.utils.log import get_logger
+
+#所有请求共用的日志对象，get_logger会重新配置日志，不宜在每次创建请求时调用
+logger = get_logger(name='Request')
+
+#headers、metadata已合并复制为请求自己的字典
+_OWNED = object()
+
+
+#合并默认值及请求自身的值，请求自身的值优先，总是返回新字典
+def _merge(defaults, values):
+    if not defaults:
+        return dict(values) if values else {}
+    return {**defaults, **values} if values else dict(defaults)
+
+
+#响应体超过MAX_BODY_SIZE时抛出，默认不重试
+class ResponseTooLarge(Exception):
+    pass
 
 
 class Request(object):
     name = 'Request'
-    #请求参数设置
-    REQUEST_CONFIG = {
+    #大量请求同时存在于内存中，使用__slots__节省内存及创建时间
+    __slots__ = ('url', 'method', 'callback', 'request_session', 'request_config', 'res_type', 'dont_filter',
+                 'priority', 'depth', 'kwargs', 'close_request_session', 'retry_count', 'exception', 'timings',
+                 'enqueued_at', 'frontier_id', '_headers', '_default_headers', '_metadata', '_default_metadata')
+    #请求参数设置，所有未指定request_config的请求共用，不可修改，需要修改时用dict(Request.REQUEST_CONFIG, ...)复制
+    REQUEST_CONFIG = MappingProxyType({
         'RETRIES': 3,
         'DELAY': 0,
         'TIMEOUT': 10,
         'RETRY_FUNC': None,
-    }
+        'RETRY_DELAY': 1,
+        'RETRY_MAX_DELAY': 60,
+        'RETRY_STATUS': None,
+        'RETRY_EXCEPTIONS': {ResponseTooLarge: 0},
+        #响应体最大字节数，None为不限制，超过即中止下载(json响应只检查Content-Length)
+        'MAX_BODY_SIZE': None,
+        #res_type为stream时整个下载的最长秒数，此时TIMEOUT只限制每次读取的等待时间
+        'MAX_DOWNLOAD_TIME': None,
+        #分块读取时每次读取的字节数，及stream模式临时文件超过多少字节后写入磁盘
+        'STREAM_CHUNK_SIZE': 64 * 1024,
+        'SPOOL_MAX_SIZE': 1024 * 1024,
+    })
 
     METHOD = ['GET', 'POST']
 
     #初始化请求参数，请求头，请求会话，回调函数，响应类型
     def __init__(self, url: str, method:str = 'GET',*,
                  callback=None,
-                 headers:dict={},
-                 metadata:dict={},
-                 request_config:dict=(),
-                 request_session=NOne,
+                 headers:dict=None,
+                 metadata:dict=None,
+                 request_config:dict=None,
+                 request_session=None,
                  res_type:str='text',
+                 dont_filter:bool=False,
+                 priority:int=0,
+                 depth:int=0,
                  **kwargs):
 
         self.url = url
@@ -41,99 +78,172 @@ class Request(object):
             raise ValueError('%s method is not supported'% self.method)
 
         self.callback = callback
-        self.headers = headers
-        self.metadata = metadata
+        #headers、metadata写时复制：创建时只保存传入的字典，首次读取时才复制，
+        #修改请求的headers、metadata不会影响传入的字典(如Spider的headers)及其它请求
+        self._headers, self._default_headers = headers, None
+        self._metadata, self._default_metadata = metadata, None
         self.request_session = request_session
         self.request_config = request_config or self.REQUEST_CONFIG
         self.res_type = res_type
+        #为True时不经过Spider的去重
+        self.dont_filter = dont_filter
+        #优先级越大越先请求；深度为由start_urls开始经过的回调层数，由Spider设置
+        self.priority = priority
+        self.depth = depth
         self.kwargs = kwargs
 
         self.close_request_session = False
-        self.logger = get_logger(name=self.name)
-        self.retry_times = self.request_config.get("RETRIES", 3)
+        #已重试次数及最近一次请求的异常，由Spider的重试策略使用
+        self.retry_count = 0
+        self.exception = None
+        #最近一次请求各阶段的耗时及接收的字节数，DNS解析等由Spider会话的aiohttp跟踪写入
+        self.timings = {}
+        #进入请求队列的时间，由请求队列设置
+        self.enqueued_at = None
+        #持久化队列中的记录id
+        self.frontier_id = None
+
+    @property
+    def headers(self):
+        if self._default_headers is not _OWNED:
+            self._headers, self._default_headers = _merge(self._default_headers, self._headers), _OWNED
+        return self._headers
+
+    @headers.setter
+    def headers(self, headers):
+        self._headers, self._default_headers = headers, None
+
+    @property
+    def metadata(self):
+        if self._default_metadata is not _OWNED:
+            self._metadata, self._default_metadata = _merge(self._default_metadata, self._metadata), _OWNED
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata, self._default_metadata = metadata, None
+
+    #设置默认的headers、metadata(如Spider的headers、metadata)，请求自身的值优先，由Spider在请求出队后调用
+    def set_defaults(self, headers=None, metadata=None):
+        if headers:
+            if self._default_headers is _OWNED:
+                self._headers = {**headers, **self._headers}
+            else:
+                self._default_headers = headers
+        if metadata:
+            if self._default_metadata is _OWNED:
+                self._metadata = {**metadata, **self._metadata}
+            else:
+                self._default_metadata = metadata
+
+    #返回可序列化的请求参数，用于请求队列及持久化队列，不包含会话等运行时对象；
+    #headers、metadata不含尚未合并的默认值，使用默认REQUEST_CONFIG时request_config为None；
+    #请求由type(request)(**request.to_dict())还原，子类新增构造参数时需重写to_dict加入这些参数
+    def to_dict(self):
+        return dict(url=self.url,
+                    method=self.method,
+                    callback=self.callback,
+                    headers=self._headers,
+                    metadata=self._metadata,
+                    request_config=None if self.request_config is self.REQUEST_CONFIG else self.request_config,
+                    res_type=self.res_type,
+                    dont_filter=self.dont_filter,
+                    priority=self.priority,
+                    depth=self.depth,
+                    **self.kwargs)
 
     @property #将该方法作为属性调用，创建请求函数
     def current_request_func(self):
-        self.logger.info(f'<{self.method}: {self.url}>')
+        logger.info(f'<{self.method}: {self.url}>')
+        kwargs = self.kwargs
+        #stream模式下会话自身的超时(aiohttp默认整体300秒)不应限制下载，只限制每次读取的等待时间
+        if self.res_type == 'stream' and 'timeout' not in kwargs:
+            kwargs = dict(kwargs, timeout=aiohttp.ClientTimeout(total=None,
+                                                                sock_read=self.request_config.get('TIMEOUT', 10)))
         # 执行请求
         if self.method == 'GET':
             request_func = self.current_request_session.get(
                 self.url,
                 headers=self.headers,
                 verify_ssl=False,
-                **self.kwargs
+                trace_request_ctx=self.timings,
+                **kwargs
             )
         else:
             request_func = self.current_request_session.post(
                 self.url,
                 headers=self.headers,
                 verify_ssl=False,
-                **self.kwargs
+                trace_request_ctx=self.timings,
+                **kwargs
             )
         return request_func
 
     @property #创建会话
     def current_request_session(self):
         if self.request_session is None:
-            self.request_session = aiohttp.ClientSession()
+            #超时由fetch按TIMEOUT及MAX_DOWNLOAD_TIME控制，会话本身不限制
+            self.request_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None))
             self.close_request_session = True
         return self.request_session
 
     #关闭会话
     async def close(self):
-        #若请求为js渲染请求，则关闭browser
-        if hasattr(self, "browser"):
-            await self.browser.close()
         if self.close_request_session:
             await self.request_session.close()
             self.request_session = None
 
-    #发起请求
+    #发起一次请求，失败时不在此重试，由Spider的重试策略延迟后重新入队
     async def fetch(self) -> Response:
         res_headers, res_history = {}, ()
         res_status = 0 #响应状态码
-        res_data, res_cookies = None, None
-        #若设置延迟，则执行延迟
-        if self.request_config.get('DELAY', 0) >0:
-            await asyncio.sleep(self.request_config['DELAY'])
+        res_data, res_body, res_cookies = None, None, None
+        self.exception = None
+        self.timings = {}
+        #DELAY由Spider的按域名限速处理，此处不再sleep
         try:
-            #超时设置
+            #超时设置，stream模式下整体只受MAX_DOWNLOAD_TIME限制
             timeout = self.request_config.get("TIMEOUT", 10)
+            if self.res_type == 'stream':
+                timeout = self.request_config.get('MAX_DOWNLOAD_TIME')
             async with async_timeout.timeout(timeout):
+                start = time.monotonic()
                 async with self.current_request_func as resp:
+                    headers_received = time.monotonic()
+                    self.timings['ttfb'] = headers_received - start
                     res_status = resp.status # 状态码无需await
-                    #确保响应成功，否则抛出异常
-                    assert res_status in [200, 201]
-                    #根据响应类型获取响应内容
-                    if self.res_type =='bytes':
-                        res_data = await resp.read()
-                    elif self.res_type == 'json':
-                        res_data = await resp.json()
-                    else:
-                        res_data = await resp.text()
-
-                    #获取响应相关信息
+                    #获取响应相关信息，失败响应的Retry-After等也需要保留
                     res_cookies, res_headers, res_history = resp.cookies, resp.headers, resp.history
+                    #确保响应成功，否则不读取响应内容
+                    if res_status in [200, 201]:
+                        #Content-Length已超过MAX_BODY_SIZE时不下载，未给出Content-Length时在读取中检查
+                        max_body_size = self.request_config.get('MAX_BODY_SIZE')
+                        if max_body_size is not None and (resp.content_length or 0) > max_body_size:
+                            raise ResponseTooLarge(f'Content-Length {resp.content_length} > {max_body_size}')
+                        #根据响应类型获取响应内容
+                        if self.res_type == 'stream':
+                            res_data = await self._read_stream(resp, max_body_size)
+                        elif self.res_type == 'json':
+                            res_data = await resp.json()
+                        else:
+                            #text响应只保存原始字节，由Response按需检测编码及解码
+                            res_body = await self._read_body(resp, max_body_size)
+                            if self.res_type == 'bytes':
+                                res_data = res_body
+                    else:
+                        logger.error(f'<Error: {self.url} {res_status}>')
+                    self.timings['download'] = time.monotonic() - headers_received
+                    #未使用带跟踪的会话时按Content-Length统计流量
+                    if 'bytes' not in self.timings:
+                        self.timings['bytes'] = resp.content_length or 0
         except Exception as e:
-            self.logger.error(f'<Error: {self.url} {res_status} {str(e)}')
-
-        #处理需要重试的请求,超过请求次数则跳过此步骤
-        if self.retry_times >0 and res_data is None:
-            retry_times = self.request_config.get("RETRIES", 3) - self.retry_times + 1
-            self.logger.info(f'<Retry url: {self.url}, Retry times: {retry_times}')
-            self.retry_times -= 1
-            retry_func = self.request_config.get('RETRY_FUNC')
-            #若设置了重试函数，则执行重试函数
-            if retry_func and iscoroutinefunction(retry_func):
-                request_ins = await retrt_func(self)
-                if isinstance(request_ins, Request):
-                    return await request_ins.fetch()
-            #否则重试原请求函数
-            return await self.fetch()
+            self.exception = e
+            logger.error(f'<Error: {self.url} {res_status} {str(e)}')
         await self.close()
 
         response = Response(url=self.url,
                             html=res_data,
+                            body=res_body,
                             metadata=self.metadata,
                             res_type=self.res_type,
                             cookies=res_cookies,
@@ -143,25 +253,66 @@ class Request(object):
         return response
 
 
+    #读取响应体，设置了MAX_BODY_SIZE时分块读取，超过即中止下载
+    async def _read_body(self, resp, max_body_size=None):
+        if max_body_size is None:
+            return await resp.read()
+        chunks, size = [], 0
+        async for chunk in resp.content.iter_chunked(self.request_config.get('STREAM_CHUNK_SIZE', 64 * 1024)):
+            size += len(chunk)
+            if size > max_body_size:
+                raise ResponseTooLarge(f'Body exceeds {max_body_size} bytes')
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    #分块读取响应体写入临时文件，超过SPOOL_MAX_SIZE的部分写入磁盘，内存占用不随响应大小增长
+    #返回指向开头的临时文件，由Response.release关闭
+    async def _read_stream(self, resp, max_body_size=None):
+        chunk_size = self.request_config.get('STREAM_CHUNK_SIZE', 64 * 1024)
+        read_timeout = self.request_config.get('TIMEOUT', 10)
+        spool = tempfile.SpooledTemporaryFile(max_size=self.request_config.get('SPOOL_MAX_SIZE', 1024 * 1024))
+        size = 0
+        try:
+            while True:
+                #单次读取超过TIMEOUT视为连接停滞
+                async with async_timeout.timeout(read_timeout):
+                    chunk = await resp.content.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_body_size is not None and size > max_body_size:
+                    raise ResponseTooLarge(f'Body exceeds {max_body_size} bytes')
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        self.timings['bytes'] = size
+        spool.seek(0)
+        return spool
+
     #处理请求及回调函数
     async def fetch_callback(self, sem) -> Tuple[AsyncGeneratorType, Response]:
         #设置并发数
         async with sem:
             res = await self.fetch()
-        #若含有回调函数，则将响应用回调函数处理
+        callback_res = await self.process_callback(res)
+        return callback_res, res
+
+    #若含有回调函数，则将响应用回调函数处理
+    async def process_callback(self, res):
         if self.callback is not None:
-           try:
-               if iscoroutinefunction(self.callback):
-                   callback_res = await self.callback(res)
-                   res.callback_result = callback_res
-               else:
-                   callback_res = self.callback(res)
-           except Exception as e:
-               self.logger.error(e)
+            try:
+                if iscoroutinefunction(self.callback):
+                    callback_res = await self.callback(res)
+                    res.callback_result = callback_res
+                else:
+                    callback_res = self.callback(res)
+            except Exception as e:
+                logger.error(e)
                 callback_res = None
         else:
             callback_res = None
-        return callback_res, res
+        return callback_res
 
     #格式化输出请求
     def __str__(self):
@@ -2,13 +2,21 @@
 
 from lxml import etree
 
+from ruia_study.encoding import detect_encoding, parse_html
+
 class Response(object):
 
+    #使用__slots__，不为每个实例创建__dict__，大量响应同时存在时减少内存占用
+    __slots__ = ('_callback_result', '_url', '_metadata', '_res_type', '_html', '_body', '_encoding',
+                 '_cookies', '_history', '_headers', '_status', '_html_etree')
+
     #初始化参数
     def __init__(self, url: str, *,
                  metadata:dict,
                  res_type: str,
                  html: str ='',
+                 body: bytes = None,
+                 encoding: str = None,
                  cookies,
                  history,
                  headers:dict = None,
@@ -19,10 +27,15 @@ class Response(object):
         self._metadata = metadata
         self._res_type = res_type
         self._html = html
+        #原始响应体，res_type为text时html在首次访问时才由body解码
+        self._body = body
+        self._encoding = encoding
         self._cookies = cookies
         self._history = history
         self._headers = headers
         self._status = status
+        #解析后的etree对象，首次访问html_etree时解析
+        self._html_etree = None
 
 
     #以下将其方法当作属性调用
@@ -44,12 +57,29 @@ class Response(object):
 
     @property
     def res_type(self):
-        return self._html
+        return self._res_type
 
     @property
     def html(self):
+        if self._html is None and self._body is not None:
+            if self._res_type == 'bytes':
+                self._html = self._body
+            else:
+                #去掉BOM
+                html = self._body.decode(self.encoding, 'replace')
+                self._html = html[1:] if html.startswith('\ufeff') else html
         return self._html
 
+    @property
+    def body(self):
+        return self._body
+
+    @property #响应体的编码，未指定时在首次访问时检测
+    def encoding(self):
+        if self._encoding is None and self._body is not None:
+            self._encoding = detect_encoding(self._body, (self._headers or {}).get('Content-Type'))
+        return self._encoding
+
     @property
     def cookies(self):
         return self._cookies
@@ -66,12 +96,32 @@ class Response(object):
     def status(self):
         return self._status
 
-    @property #返回html_etree对象
+    @property #返回html_etree对象，只解析一次，之后返回缓存的结果；stream响应不解析
+    #有原始响应体时直接按检测到的编码解析字节，无需先解码为字符串
     def html_etree(self):
-        html_etree = None
-        if self.html:
-            html_etree = etree.HTML(self.html)
-        return html_etree
+        if self._html_etree is None and self._res_type != 'stream':
+            if self._body:
+                self._html_etree = parse_html(self._body, self.encoding)
+            elif self._body is None and self.html:
+                self._html_etree = etree.HTML(self.html)
+        return self._html_etree
+
+    #res_type为stream时html为临时文件，按块异步迭代响应体
+    async def iter_chunks(self, chunk_size=64 * 1024):
+        if self._res_type != 'stream' or self._html is None:
+            raise ValueError("res_type 'stream' is expected")
+        while True:
+            chunk = self._html.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    #释放解析后的etree对象，不再需要时调用以减少内存占用，之后访问html_etree会重新解析
+    #stream响应的临时文件在此关闭
+    def release(self):
+        self._html_etree = None
+        if self._res_type == 'stream' and self._html is not None:
+            self._html.close()
 
     def __str__(self):
         return f'<Response url[{self._res_type}]'
\ No newline at end of file
@@ -0,0 +1,62 @@
+#-*-coding:utf8-*-
+
+import random
+
+from ruia_study.ratelimit import TokenBucket, parse_retry_after
+
+
+#重试策略，由Spider在请求失败后调用，决定是否重试及重试前的等待秒数
+#重试次数及退避时间从请求的request_config中读取：
+#RETRIES为默认重试次数，RETRY_STATUS、RETRY_EXCEPTIONS可按状态码、异常类型单独设置重试次数，
+#第n次重试前等待 min(RETRY_MAX_DELAY, RETRY_DELAY * 2^n) 秒，并加上随机抖动
+class RetryPolicy:
+
+    def __init__(self, retry_rate=0):
+        #全局每秒最多重试次数，避免大量失败请求挤占正常请求，0为不限制
+        self.retry_bucket = TokenBucket(retry_rate, retry_rate) if retry_rate else None
+
+    #获取该次失败对应的重试次数
+    @staticmethod
+    def get_retry_budget(request, response):
+        config = request.request_config
+        budget = config.get('RETRIES', 3)
+        if request.exception is not None:
+            for exception_cls, exception_budget in (config.get('RETRY_EXCEPTIONS') or {}).items():
+                if isinstance(request.exception, exception_cls):
+                    return exception_budget
+        else:
+            budget = (config.get('RETRY_STATUS') or {}).get(response.status, budget)
+        return budget
+
+    #请求失败且未超过重试次数时返回重试前需等待的秒数，否则返回None
+    def get_retry_delay(self, request, response):
+        if response.body is not None or response.html is not None:
+            return None
+        if request.retry_count >= self.get_retry_budget(request, response):
+            return None
+        config = request.request_config
+        delay = self.get_backoff(request)
+        #服务器给出Retry-After时至少等待该时长
+        retry_after = parse_retry_after((response.headers or {}).get('Retry-After'))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, config.get('RETRY_MAX_DELAY', 60)))
+        if self.retry_bucket is not None:
+            delay = max(delay, self.retry_bucket.reserve())
+        return delay
+
+    #第n次重试前的退避时间，加上随机抖动，避免同时失败的请求同时重试
+    @staticmethod
+    def get_backoff(request):
+        config = request.request_config
+        backoff = min(config.get('RETRY_MAX_DELAY', 60), config.get('RETRY_DELAY', 1) * 2 ** request.retry_count)
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    #响应中间件要求重新请求时的等待秒数，与失败重试共用RETRIES次数，超过时返回None
+    def get_reschedule_delay(self, request, delay=None):
+        if request.retry_count >= request.request_config.get('RETRIES', 3):
+            return None
+        if delay is None:
+            delay = self.get_backoff(request)
+        if self.retry_bucket is not None:
+            delay = max(delay, self.retry_bucket.reserve())
+        return delay
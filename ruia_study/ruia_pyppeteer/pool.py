@@ -0,0 +1,139 @@
+#-*-coding:utf8-*-
+
+import asyncio
+import pyppeteer
+
+from contextlib import asynccontextmanager
+
+from ruia_study.settings import PYPPETEER_CONFIG
+from ruia_study.utils.log import get_logger
+
+
+#池中的单个浏览器，记录空闲页面、正在使用的页面数及累计渲染的页面数
+class _PooledBrowser:
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.idle_pages = []
+        self.in_use = 0
+        self.uses = 0
+        #达到RECYCLE_AFTER后不再分配页面，所有页面归还后关闭
+        self.retired = False
+
+
+#多个请求共用的浏览器池，页面用完后归还复用而不是每个请求启动一个浏览器，
+#同时打开的页面数即js渲染的并发数，与Spider的并发数相互独立
+class BrowserPool:
+
+    name = 'BrowserPool'
+
+    def __init__(self, pyppeteer_config=None, *, launch_args=(), launch_options=None):
+        config = dict(PYPPETEER_CONFIG, **(pyppeteer_config or {}))
+        self.max_browsers = max(1, config['MAX_BROWSERS'])
+        self.max_pages = max(1, config['MAX_PAGES'])
+        self.recycle_after = config['RECYCLE_AFTER']
+        self.block_resources = frozenset(config['BLOCK_RESOURCES'] or ())
+        self.launch_args = list(launch_args)
+        if '--no-sandbox' not in self.launch_args:
+            self.launch_args.append('--no-sandbox')
+        self.launch_options = launch_options or {}
+        #页面数平均分配到各浏览器
+        self.pages_per_browser = -(-self.max_pages // self.max_browsers)
+        self.sem = asyncio.Semaphore(self.max_pages)
+        self.browsers = []
+        self._lock = asyncio.Lock()
+        self.logger = get_logger(name=self.name)
+
+    async def _launch(self):
+        self.logger.info(f'<Launch browser: {len(self.browsers) + 1}>')
+        return await pyppeteer.launch(headless=True, args=self.launch_args, options=self.launch_options)
+
+    #选择正在使用页面数最少的浏览器，均已占满且未达到MAX_BROWSERS时启动新的浏览器
+    async def _get_browser(self):
+        async with self._lock:
+            active = [browser for browser in self.browsers if not browser.retired]
+            browser = min(active, key=lambda browser: browser.in_use, default=None)
+            if browser is None or (browser.in_use >= self.pages_per_browser and len(active) < self.max_browsers):
+                browser = _PooledBrowser(await self._launch())
+                self.browsers.append(browser)
+            browser.in_use += 1
+            browser.uses += 1
+            if self.recycle_after and browser.uses >= self.recycle_after:
+                browser.retired = True
+            return browser
+
+    async def _new_page(self, browser):
+        page = await browser.browser.newPage()
+        #拦截请求，不加载BLOCK_RESOURCES中的资源类型
+        if self.block_resources:
+            await page.setRequestInterception(True)
+            page.on('request', lambda request: asyncio.ensure_future(self._intercept(request)))
+        return page
+
+    async def _intercept(self, request):
+        try:
+            if request.resourceType in self.block_resources:
+                await request.abort()
+            else:
+                await request.continue_()
+        except Exception:
+            #页面关闭后请求已失效
+            pass
+
+    #获取一个页面，超过MAX_PAGES时等待其它页面归还
+    async def acquire(self):
+        await self.sem.acquire()
+        browser = None
+        try:
+            browser = await self._get_browser()
+            page = browser.idle_pages.pop() if browser.idle_pages else await self._new_page(browser)
+        except BaseException:
+            if browser is not None:
+                browser.in_use -= 1
+                await self._close_retired(browser)
+            self.sem.release()
+            raise
+        return browser, page
+
+    #归还页面，出错的页面及待重启浏览器的页面直接关闭，否则跳转到空白页后复用
+    async def release(self, browser, page, reuse=True):
+        try:
+            if reuse and not browser.retired:
+                await page.goto('about:blank')
+                browser.idle_pages.append(page)
+            else:
+                await page.close()
+        except Exception as e:
+            self.logger.error(f'<Release page error: {e}>')
+        finally:
+            browser.in_use -= 1
+            self.sem.release()
+        await self._close_retired(browser)
+
+    async def _close_retired(self, browser):
+        if browser.retired and browser.in_use == 0 and browser in self.browsers:
+            self.browsers.remove(browser)
+            self.logger.info(f'<Recycle browser after {browser.uses} pages>')
+            try:
+                await browser.browser.close()
+            except Exception as e:
+                self.logger.error(f'<Close browser error: {e}>')
+
+    #用法: async with pool.page() as page: ...，执行出错时该页面不再复用
+    @asynccontextmanager
+    async def page(self):
+        browser, page = await self.acquire()
+        reuse = False
+        try:
+            yield page
+            reuse = True
+        finally:
+            await self.release(browser, page, reuse)
+
+    async def close(self):
+        browsers, self.browsers = self.browsers, []
+        for browser in browsers:
+            try:
+                await browser.browser.close()
+            except Exception as e:
+                self.logger.error(f'<Close browser error: {e}>')
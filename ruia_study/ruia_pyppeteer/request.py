@@ -1,28 +1,29 @@
 #-*-coding:utf8-*-
 
-import asyncio
-import async_timeout
-import pyppeteer
+import time
 
-from inspect import iscoroutinefunction
-
-from ruia import Request
-from ruia.response import Response
+from ruia_study.request import Request, logger
+from ruia_study.response import Response
+from ruia_study.ruia_pyppeteer.pool import BrowserPool
 
 
 class PyppeteerRequest(Request):
     '''
     此处只注释与Request不同的地方
     '''
+    __slots__ = ('load_js', 'pyppeteer_args', 'pyppeteer_launch_options', 'pyppeteer_page_options', 'browser_pool')
+    #未设置browser_pool时所有请求共用的默认浏览器池
+    _default_browser_pool = None
+
     def __init__(self, url: str, method: str = 'GET', *,
                  callback=None,
-                 headers: dict = {},
+                 headers: dict = None,
                  load_js: bool = False, #是否使用js加载
-                 metadata: dict = {},
-                 pyppeteer_args: list = [],  # pyppeteer参数列表
-                 pyppeteer_launch_options: dict = {},
-                 pyppeteer_page_options: dict = {},
-                 request_config: dict = {},
+                 metadata: dict = None,
+                 pyppeteer_args: list = (),  # pyppeteer参数列表
+                 pyppeteer_launch_options: dict = None,
+                 pyppeteer_page_options: dict = None,
+                 request_config: dict = None,
                  request_session=None,
                  res_type: str = 'text',
                  **kwargs):
@@ -38,58 +39,61 @@ class PyppeteerRequest(Request):
         self.pyppeteer_args = pyppeteer_args
         self.pyppeteer_launch_options = pyppeteer_launch_options #浏览器参数
         self.pyppeteer_page_options = pyppeteer_page_options #页面控制参数
+        #js渲染使用的浏览器池，由PyppeteerSpider设置；未设置时使用默认池
+        self.browser_pool = None
+
+    def to_dict(self):
+        return dict(super(PyppeteerRequest, self).to_dict(),
+                    load_js=self.load_js,
+                    pyppeteer_args=self.pyppeteer_args,
+                    pyppeteer_launch_options=self.pyppeteer_launch_options,
+                    pyppeteer_page_options=self.pyppeteer_page_options)
+
+    #默认池按第一个js请求的pyppeteer_args及pyppeteer_launch_options启动浏览器，
+    #不使用PyppeteerSpider时需在结束后调用PyppeteerRequest.close_default_browser_pool
+    def get_browser_pool(self):
+        if self.browser_pool is not None:
+            return self.browser_pool
+        cls = PyppeteerRequest
+        if cls._default_browser_pool is None:
+            cls._default_browser_pool = BrowserPool(launch_args=self.pyppeteer_args,
+                                                    launch_options=self.pyppeteer_launch_options)
+        return cls._default_browser_pool
 
+    @staticmethod
+    async def close_default_browser_pool():
+        pool, PyppeteerRequest._default_browser_pool = PyppeteerRequest._default_browser_pool, None
+        if pool is not None:
+            await pool.close()
+
+    #发起一次请求，失败时不在此重试，由Spider的重试策略延迟后重新入队
     async def fetch(self) -> Response:
-        if self.request_config.get('DELAY', 0) > 0:
-            await asyncio.sleep(self.request_config['DELAY'])
+        if not self.load_js:
+            return await super(PyppeteerRequest, self).fetch()
+        res_headers, res_history = {}, ()
+        res_status = 0
+        data, res_cookies = None, None
+        self.exception = None
+        self.timings = {}
         try:
             timeout = self.request_config.get('TIMEOUT', 10)
-
-            if self.load_js:  # 此处则由pyppeteer发送请求而不是aiohttp
-                if not hasattr(self, "browser"):
-                    self.pyppeteer_args.extend(['--no-sandbox'])
-                    self.browser = await pyppeteer.launch(
-                        headless=True,
-                        args=self.pyppeteer_args,
-                        options=self.pyppeteer_launch_options
-                    )
-                page = await  self.browser.newPage() # 开启新页面
-                self.pyppeteer_page_options.update({'timeout': int(timeout * 1000)}) #页面超时设置
-                res = await page.goto(self.url, options=self.pyppeteer_page_options)
-                data = await page.content()
-                res_cookies = await page.cookies()
+            # 此处则由pyppeteer发送请求而不是aiohttp，页面从浏览器池中获取，用完后归还
+            async with self.get_browser_pool().page() as page:
+                page_options = dict(self.pyppeteer_page_options or {}, timeout=int(timeout * 1000)) #页面超时设置
+                start = time.monotonic()
+                res = await page.goto(self.url, options=page_options)
+                #js渲染无法区分首字节及下载，页面加载耗时均计入ttfb
+                self.timings['ttfb'] = time.monotonic() - start
                 res_headers = res.headers
-                res_history = None
                 res_status = res.status
-            else:
-                async with async_timeout.timeout(timeout):
-                    async with self.current_request_func as resp:
-                        res_status = resp.status
-                        assert res_status in [200, 201]
-                        if self.res_type == 'bytes':
-                            data = await resp.read()
-                        elif self.res_type == 'json':
-                            data = await resp.json()
-                        else:
-                            data = await resp.text()
-                        res_cookies, res_headers, res_history = resp.cookies, resp.headers, resp.history
+                if res_status in [200, 201]:
+                    data = await page.content()
+                    res_cookies = await page.cookies()
+                else:
+                    logger.error(f"<Error: {self.url} {res_status}>")
         except Exception as e:
-            res_headers = {}
-            res_history = ()
-            res_status = 0
-            data, res_cookies = None, None
-            self.logger.error(f"<Error: {self.url} {res_status} {str(e)}>")
-
-        if self.retry_times > 0 and data is None:
-            retry_times = self.request_config.get('RETRIES', 3) - self.retry_times + 1
-            self.logger.info(f'<Retry url: {self.url}>, Retry times: {retry_times}')
-            self.retry_times -= 1
-            retry_func = self.request_config.get('RETRY_FUNC')
-            if retry_func and iscoroutinefunction(retry_func):
-                request_ins = await retry_func(self)
-                if isinstance(request_ins, Request):
-                    return await request_ins.fetch()
-            return await self.fetch()
+            self.exception = e
+            logger.error(f"<Error: {self.url} {res_status} {str(e)}>")
 
         await self.close()
 
@@ -101,4 +105,4 @@ class PyppeteerRequest(Request):
                             headers=res_headers,
                             history=res_history,
                             status=res_status)
-        return response
\ No newline at end of file
+        return response
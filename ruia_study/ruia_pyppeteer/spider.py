@@ -0,0 +1,29 @@
+#-*-coding:utf8-*-
+
+from ruia_study.ruia_pyppeteer.pool import BrowserPool
+from ruia_study.ruia_pyppeteer.request import PyppeteerRequest
+from ruia_study.spider import Spider
+
+
+class PyppeteerSpider(Spider):
+    #浏览器池配置，未设置的项使用settings中的PYPPETEER_CONFIG
+    pyppeteer_config = None
+    #启动浏览器的参数
+    pyppeteer_args = []
+    pyppeteer_launch_options = {}
+
+    #爬虫中所有js渲染请求共用一个浏览器池，爬虫停止时关闭
+    def __init__(self, middleware=None, loop=None, shard=None, pipeline=None):
+        super(PyppeteerSpider, self).__init__(middleware=middleware, loop=loop, shard=shard, pipeline=pipeline)
+        self.browser_pool = BrowserPool(self.pyppeteer_config,
+                                        launch_args=self.pyppeteer_args,
+                                        launch_options=self.pyppeteer_launch_options)
+
+    async def handle_request(self, request, response=None):
+        if isinstance(request, PyppeteerRequest) and request.browser_pool is None:
+            request.browser_pool = self.browser_pool
+        return await super(PyppeteerSpider, self).handle_request(request, response)
+
+    async def _close_resources(self):
+        await super(PyppeteerSpider, self)._close_resources()
+        await self.browser_pool.close()
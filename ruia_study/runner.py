@@ -0,0 +1,148 @@
+#-*-coding:utf8-*-
+
+import multiprocessing
+import os
+import queue
+import threading
+import zlib
+
+from datetime import datetime
+from urllib.parse import urlparse
+
+from ruia_study.frontier import record_to_request, request_to_record
+from ruia_study.stats import merge_stats
+from ruia_study.utils.log import get_logger
+
+
+#按域名哈希计算url所属的进程，同一域名的请求始终由同一进程处理，限速及连接复用均在进程内
+def shard_for_url(url, shard_count):
+    host = (urlparse(url).hostname or '').encode('utf-8')
+    return zlib.crc32(host) % shard_count
+
+
+#单个进程的分片上下文，由ShardedRunner创建并传给Spider
+#pending为所有进程共享的未完成请求数，降为0时所有进程结束；
+#aborted在某个进程异常退出时由ShardedRunner设置，其计数无法再释放，其余进程处理完本地请求后结束
+class ShardContext:
+
+    def __init__(self, shard_id, shard_count, inboxes, pending, aborted):
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.inboxes = inboxes
+        self.pending = pending
+        self.aborted = aborted
+
+    def owns(self, url):
+        return shard_for_url(url, self.shard_count) == self.shard_id
+
+    def add(self, n=1):
+        with self.pending.get_lock():
+            self.pending.value += n
+
+    def done(self, n=1):
+        self.add(-n)
+
+    def finished(self):
+        return self.pending.value <= 0 or self.aborted.is_set()
+
+    #将不属于本进程的请求转发给所属进程，先计数再发送，保证发送途中不会被误判为全部完成，返回是否转发
+    def forward(self, request, spider):
+        try:
+            record = request_to_record(request, spider)
+        except Exception as e:
+            #无法序列化的请求(如回调为lambda)不转发，且未计数，由本进程处理
+            spider.logger.warning(f'<Request can not be forwarded, handled locally: {request} {e}>')
+            return False
+        self.add()
+        self.inboxes[shard_for_url(request.url, self.shard_count)].put(record)
+        return True
+
+    #在后台线程中接收其它进程转发的请求，交由事件循环塞入请求队列
+    def start_receiving(self, spider):
+        inbox = self.inboxes[self.shard_id]
+
+        def receive():
+            while True:
+                record = inbox.get()
+                spider.loop.call_soon_threadsafe(self._enqueue, spider, record)
+
+        threading.Thread(target=receive, daemon=True).start()
+
+    def _enqueue(self, spider, record):
+        try:
+            request = record_to_request(record, spider)
+        except Exception as e:
+            spider.logger.error(f'<Restore forwarded request failed: {e}>')
+            self.done()
+            return
+        spider.enqueue_request(request, forwarded=True)
+
+
+#子进程入口，运行分到的Spider并返回统计信息
+def _run_shard(spider_cls, shard, results, start_kwargs):
+    spider_ins = spider_cls.start(shard=shard, **start_kwargs)
+    #异常退出的进程不再读取其收件箱，退出时不等待发往它的请求写完，否则可能一直阻塞
+    if shard.aborted.is_set():
+        for inbox in shard.inboxes:
+            inbox.cancel_join_thread()
+    results.put(dict(spider_ins.stats.to_dict(), shard_id=shard.shard_id, pid=os.getpid()))
+
+
+#单机多进程运行同一个Spider类，start_urls及回调产生的请求按域名分配到各进程，
+#结束后汇总各进程的统计信息
+class ShardedRunner:
+
+    name = 'Runner'
+
+    def __init__(self, spider_cls, processes=None):
+        self.spider_cls = spider_cls
+        self.processes = processes or os.cpu_count() or 1
+        self.logger = get_logger(name=self.name)
+
+    #start_kwargs为传给Spider.start的参数，如middleware、after_start等
+    def run(self, **start_kwargs):
+        start_time = datetime.now()
+        inboxes = [multiprocessing.Queue() for _ in range(self.processes)]
+        #每个进程先占一个计数，塞入start_urls后再释放，避免先启动的进程在其它进程转发请求前就结束
+        pending = multiprocessing.Value('q', self.processes)
+        aborted = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=_run_shard,
+                args=(self.spider_cls, ShardContext(i, self.processes, inboxes, pending, aborted), results,
+                      start_kwargs),
+                name=f'{self.spider_cls.name}-{i}',
+            )
+            for i in range(self.processes)
+        ]
+        for worker in workers:
+            worker.start()
+        shard_stats = []
+        lost = set()
+        while len(shard_stats) < self.processes:
+            try:
+                shard_stats.append(results.get(timeout=1))
+            except queue.Empty:
+                #进程异常退出时其未完成的请求及转发给它的请求均已丢失，通知其余进程结束
+                for shard_id, worker in enumerate(workers):
+                    if worker.exitcode and shard_id not in lost:
+                        lost.add(shard_id)
+                        aborted.set()
+                        self.logger.error(f'<Shard {shard_id} exited with code {worker.exitcode}, '
+                                          f'its pending requests are lost>')
+                if not any(worker.is_alive() for worker in workers):
+                    break
+        for worker in workers:
+            worker.join()
+
+        #各阶段耗时直方图按桶相加
+        merged = merge_stats(shard_stats)
+        self.logger.info(f'Shards finished: {len(shard_stats)}/{self.processes}')
+        self.logger.info(f'Total requests: {merged.success_counts + merged.failed_counts}')
+        if merged.failed_counts:
+            self.logger.info(f'Failed requests: {merged.failed_counts}')
+        self.logger.info(merged.summary())
+        self.logger.info(f'Time usage: {datetime.now() - start_time}')
+        return dict(merged.to_dict(), shards=sorted(shard_stats, key=lambda stats: stats['shard_id']),
+                    lost_shards=sorted(lost))
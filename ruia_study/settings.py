@@ -4,4 +4,107 @@ REQUEST_CONFIG = {
     'RETRIES': 3,
     'DELAY': 0,
     'TIMEOUT': 10,
-}
\ No newline at end of file
+}
+
+#连接池配置，包括总连接数，单个host连接数，keep-alive时长，DNS缓存时长
+CONNECTOR_CONFIG = {
+    'LIMIT': 100,
+    'LIMIT_PER_HOST': 0,
+    'KEEPALIVE_TIMEOUT': 15,
+    'FORCE_CLOSE': False,
+    'USE_DNS_CACHE': True,
+    'TTL_DNS_CACHE': 300,
+}
+
+#按域名限速配置，RATE为每秒请求数(0为不限速)，BURST为允许的突发请求数，
+#RETRY_AFTER为是否遵循429/503响应的Retry-After，BACKOFF为429未给出Retry-After时的暂停秒数，
+#DOMAINS可针对单个域名覆盖上述配置，如{'www.example.com': {'RATE': 1}}
+RATE_LIMIT_CONFIG = {
+    'RATE': 0,
+    'BURST': 1,
+    'RETRY_AFTER': True,
+    'BACKOFF': 30,
+    'MAX_RETRY_AFTER': 600,
+    'DOMAINS': {},
+}
+
+#请求去重配置，BACKEND可选'set'(精确去重)、'bloom'(布隆过滤器，内存固定)或None(不去重)，
+#CAPACITY为布隆过滤器预计的请求数，ERROR_RATE为可接受的误判率
+DUPEFILTER_CONFIG = {
+    'BACKEND': 'set',
+    'CAPACITY': 1000000,
+    'ERROR_RATE': 0.001,
+}
+
+#持久化队列配置，PATH为SQLite文件路径(None为不持久化)，BATCH_SIZE及FLUSH_INTERVAL控制批量写入，
+#CHECKPOINT_INTERVAL为保存去重状态的间隔秒数；
+#MAX_SIZE为回调产生的请求在内存队列中排队的上限(0为不限制)，达到上限时回调在yield新请求处暂停，
+#工人继续出队，队列有空位时再恢复；重试、恢复及其它进程转发的请求不受此限制；
+#扇出很大的bfs爬取中，超出的部分以暂停的回调(每个保留一个响应)的形式存在，数量约为不限制时队列长度除以扇出
+FRONTIER_CONFIG = {
+    'PATH': None,
+    'MAX_SIZE': 0,
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 1,
+    'CHECKPOINT_INTERVAL': 60,
+}
+
+#统计信息配置，LOG_INTERVAL为输出概要日志的间隔秒数(0为不输出)，
+#JSON_PATH、PROMETHEUS_PATH为定期写入统计快照的文件路径(None为不写入)
+STATS_CONFIG = {
+    'LOG_INTERVAL': 60,
+    'JSON_PATH': None,
+    'PROMETHEUS_PATH': None,
+}
+
+#js渲染的浏览器池配置，MAX_BROWSERS为同时运行的浏览器数，MAX_PAGES为所有浏览器同时打开的页面数(即js渲染的并发数)，
+#RECYCLE_AFTER为单个浏览器渲染多少个页面后重启以限制内存增长(None为不重启)，
+#BLOCK_RESOURCES为不加载的资源类型，如('image', 'font', 'media')
+PYPPETEER_CONFIG = {
+    'MAX_BROWSERS': 1,
+    'MAX_PAGES': 4,
+    'RECYCLE_AFTER': 200,
+    'BLOCK_RESOURCES': (),
+}
+
+#自适应并发配置，ADAPTIVE为False时并发数固定为Spider的concurrency；为True时以concurrency为初始值，
+#全局及每个域名(HOST_开头的配置)的并发数分别在MIN与MAX之间按AIMD调整：
+#响应正常且首字节耗时未超过基准的LATENCY_FACTOR倍时，每个请求增加INCREASE/当前并发数(约每轮增加INCREASE)，
+#超时、连接错误、429、5xx或耗时过长时乘以DECREASE，上次减少前已发出的请求不再触发减少；
+#这些信号只调整所属域名的并发数，全局并发数只在本机资源不足(如文件描述符耗尽)的连接错误，
+#或最近GLOBAL_WINDOW秒内有响应的域名中至少GLOBAL_MIN_HOSTS个且不少于GLOBAL_OVERLOAD_RATIO比例过载时减少
+CONCURRENCY_CONFIG = {
+    'ADAPTIVE': False,
+    'MIN': 1,
+    'MAX': 64,
+    'HOST_INITIAL': 2,
+    'HOST_MIN': 1,
+    'HOST_MAX': 16,
+    'INCREASE': 1,
+    'DECREASE': 0.5,
+    'LATENCY_FACTOR': 3,
+    'GLOBAL_WINDOW': 10,
+    'GLOBAL_MIN_HOSTS': 3,
+    'GLOBAL_OVERLOAD_RATIO': 0.5,
+}
+
+#日志配置，QUEUE为True时日志放入队列由后台线程格式化及输出，不阻塞事件循环；
+#SAMPLE_RATES为按事件("日志名.级别")输出的比例，RATE_LIMITS为按事件每秒最多输出的条数，
+#如{'Request.INFO': 0}不再逐个输出请求的url，改由STATS_CONFIG['LOG_INTERVAL']定期输出的进度日志代替，
+#{'Request.ERROR': 10}为每秒最多输出10条请求失败的日志
+LOG_CONFIG = {
+    'QUEUE': False,
+    'SAMPLE_RATES': {},
+    'RATE_LIMITS': {},
+}
+
+#事件循环延迟监控及慢回调分析配置，ENABLED为True时每隔LAG_INTERVAL秒测量一次事件循环延迟，
+#并统计每次回调(包括其中Item的clean_*方法)及中间件占用事件循环的时间，单次占用超过SLOW_THRESHOLD秒时输出警告；
+#TOP_N为保留的最慢调用数，CPROFILE为True时为这些调用附带cProfile报告(开销较大)，结果在统计信息的extra['profile']中
+PROFILE_CONFIG = {
+    'ENABLED': False,
+    'LAG_INTERVAL': 0.1,
+    'SLOW_THRESHOLD': 0.1,
+    'TOP_N': 10,
+    'CPROFILE': False,
+}
@@ -1,26 +1,87 @@
 #-*-coding:utf8-*-
 
+import aiohttp
 import asyncio
+import time
 
+from collections import deque
 from functools import reduce
-from inspect import isawaitable
+from inspect import isasyncgenfunction, isawaitable, iscoroutinefunction
 from datetime import datetime
+from signal import SIGINT, SIGTERM
 from types import AsyncGeneratorType
 
+from ruia_study.concurrency import ConcurrencyController
+from ruia_study.dupefilter import get_dupefilter
+from ruia_study.frontier import PriorityRequestQueue, SqliteFrontierStore
+from ruia_study.middleware import DROP, Middleware, Reschedule
+from ruia_study.parse_pool import ParsePool
+from ruia_study.pipeline import Pipeline
+from ruia_study.profiler import CallProfiler
+from ruia_study.ratelimit import DomainRateLimiter
+from ruia_study.request import Request
+from ruia_study.response import Response
+from ruia_study.retry import RetryPolicy
+from ruia_study.settings import CONNECTOR_CONFIG, FRONTIER_CONFIG, LOG_CONFIG, PROFILE_CONFIG, STATS_CONFIG
+from ruia_study.stats import CrawlStats, create_trace_config, write_snapshot
+from ruia_study.utils.log import get_logger, setup_logging, shutdown_logging
+
+
+#协程生成器回调的迭代状态，请求队列已满时连同尚未入队的请求pending一起暂停
+class _CallbackState:
+
+    __slots__ = ('request', 'response', 'callback_res', 'pending', 'callback_time')
+
+    def __init__(self, request, response, callback_res):
+        self.request = request
+        self.response = response
+        self.callback_res = callback_res
+        self.pending = None
+        self.callback_time = 0.0
+
+
 class Spider:
     #爬虫名称
     name = 'ruia'
-    #初始urls, 初始任务列表
-    start_urls, worker_tasks = [], []
+    #初始urls
+    start_urls = []
     #请求配置，包括重试次数，超时限制，请求延迟秒数
     request_config = None
-    #请求成功数、失败数
-    failed_counts, success_counts = 0, 0
+    #所有请求默认的请求头及metadata，请求出队后与请求自身的值合并，请求自身的值优先
+    headers = None
+    metadata = None
+    #连接池配置，未设置的项使用settings中的CONNECTOR_CONFIG
+    connector_config = None
+    #按域名限速配置，未设置的项使用settings中的RATE_LIMIT_CONFIG
+    rate_limit_config = None
+    #请求去重配置，未设置的项使用settings中的DUPEFILTER_CONFIG
+    dupefilter_config = None
+    #持久化队列配置，设置PATH后可在中断后继续爬取，未设置的项使用settings中的FRONTIER_CONFIG
+    frontier_config = None
+    #爬取策略，优先级相同时'bfs'先请求浅层页面，'dfs'先请求深层页面
+    crawl_policy = 'bfs'
+    #最大爬取深度，start_urls深度为0，为None时不限制
+    max_depth = None
+    #全局每秒最多重试次数，0为不限制
+    retry_rate = 0
+    #解析进程数，大于0时extract_items在进程池中解析html，0为在事件循环中解析
+    parse_process_numbers = 0
+    #item管道，回调中yield的Item或字典交由其处理及写入，可由start的pipeline参数覆盖
+    pipeline = None
+    #自适应并发配置，未设置的项使用settings中的CONCURRENCY_CONFIG
+    concurrency_config = None
+    #统计信息配置，未设置的项使用settings中的STATS_CONFIG
+    stats_config = None
+    #日志配置，未设置的项使用settings中的LOG_CONFIG
+    log_config = None
+    #事件循环延迟监控及慢回调分析配置，未设置的项使用settings中的PROFILE_CONFIG
+    profile_config = None
     #concurrency并发数可单独设置，默认为3
+    #worker_numbers工人数可单独设置，默认与并发数相同
 
 
     #初始化中间件，事件循环，日志，并发数，请求队列
-    def __init__(self,middleware=None, loop=None):
+    def __init__(self,middleware=None, loop=None, shard=None, pipeline=None):
         #确保初始urls存在且为list
         if not self.start_urls or not isinstance(self.start_urls, list):
             raise ValueError("Spider must have a param named start_urls, eg: start_urls = ['https://www.github.com']")
@@ -34,17 +95,78 @@ class Spider:
             self.middleware = reduce(lambda x, y: x+y, middleware)
         else:
             self.middleware = middleware or Middleware()
-        #ascyncio队列
-        self.request_queue = asyncio.Queue()
-        #并发数,默认为3
-        self.sem  = asyncio.Semaphore(getattr(self, 'concurrency', 3))
+        #检查并固定中间件链，运行时不再检查是否为协程
+        self.request_middleware, self.response_middleware = self.middleware.compile()
+        #统计信息，包括请求成功数、失败数及各阶段耗时
+        self.stats = CrawlStats()
+        self.stats_config = dict(STATS_CONFIG, **(self.stats_config or {}))
+        #事件循环延迟监控及慢回调、慢中间件分析，未开启时为None
+        profile_config = dict(PROFILE_CONFIG, **(self.profile_config or {}))
+        if profile_config['ENABLED']:
+            self.profiler = CallProfiler(lag_interval=profile_config['LAG_INTERVAL'],
+                                         slow_threshold=profile_config['SLOW_THRESHOLD'],
+                                         top_n=profile_config['TOP_N'],
+                                         use_cprofile=profile_config['CPROFILE'])
+            self.stats.extra['profile'] = self.profiler
+        else:
+            self.profiler = None
+        #多进程运行时的分片上下文，见runner.ShardedRunner
+        self.shard = shard
+        #按域名限速，代替原来在Request.fetch中的DELAY
+        request_config = getattr(self, 'request_config') or Request.REQUEST_CONFIG
+        self.rate_limiter = DomainRateLimiter(self.rate_limit_config, delay=request_config.get('DELAY', 0))
+        #按优先级及深度出队的asyncio队列，队列中保存轻量的请求描述，按域名限速的请求在队列中等待令牌
+        frontier_config = dict(FRONTIER_CONFIG, **(self.frontier_config or {}))
+        self.request_queue = PriorityRequestQueue(max_size=frontier_config['MAX_SIZE'], crawl_policy=self.crawl_policy,
+                                                  rate_limiter=self.rate_limiter, stats=self.stats)
+        #因请求队列已满而暂停的回调，队列有空位时由工人按暂停顺序恢复
+        self.parked = deque()
+        #并发数,默认为3，开启自适应并发时为初始并发数
+        concurrency = getattr(self, 'concurrency', 3)
+        self.concurrency_controller = ConcurrencyController(concurrency, self.concurrency_config, stats=self.stats)
+        #工人数，工人数少于并发数时并发无法跑满，默认为最大并发数
+        self.worker_numbers = getattr(self, 'worker_numbers', None) or self.concurrency_controller.max_concurrency
+        #所有请求共用的会话，在start_master中创建
+        self.request_session = getattr(self, 'request_session', None)
+        self.close_request_session = self.request_session is None
+        #重试策略，失败的请求按指数退避延迟后重新入队，等待重试的任务保存在retry_tasks中
+        self.retry_policy = RetryPolicy(retry_rate=self.retry_rate)
+        self.retry_tasks = set()
+        #解析进程池
+        self.parse_pool = ParsePool(self.parse_process_numbers) if self.parse_process_numbers else None
+        #item管道，未设置时回调中yield的item被忽略
+        self.pipeline = pipeline or self.pipeline
+        if self.pipeline is not None and not isinstance(self.pipeline, Pipeline):
+            raise ValueError('pipeline must be an instance of Pipeline')
+        #请求去重器，为None时不去重
+        self.dupefilter = get_dupefilter(self.dupefilter_config)
+        #持久化队列
+        if frontier_config['PATH']:
+            #多进程运行时每个进程使用单独的文件
+            path = frontier_config['PATH'] if shard is None else f"{frontier_config['PATH']}.{shard.shard_id}"
+            self.frontier_store = SqliteFrontierStore(path,
+                                                      batch_size=frontier_config['BATCH_SIZE'],
+                                                      flush_interval=frontier_config['FLUSH_INTERVAL'],
+                                                      checkpoint_interval=frontier_config['CHECKPOINT_INTERVAL'])
+        else:
+            self.frontier_store = None
+
+    #请求成功数、失败数
+    @property
+    def success_counts(self):
+        return self.stats.success_counts
+
+    @property
+    def failed_counts(self):
+        return self.stats.failed_counts
 
     #必须实现parse，否则抛出未实现异常
     async def parse(self,res):
         raise NotImplementedError
 
     @classmethod  #爬虫开始入口
-    def start(cls, after_start=None, before_stop=None,middleware=None, loop=None, close_event_loop=True):
+    def start(cls, after_start=None, before_stop=None,middleware=None, loop=None, close_event_loop=True, shard=None,
+              pipeline=None):
         """
         Start a spider
         :param after_start:
@@ -52,10 +174,16 @@ class Spider:
         :param middleware:
         :param loop:
         :param close_event_loop:
-        :return:
+        :param shard: ShardContext, set by ShardedRunner
+        :param pipeline: Pipeline for items yielded by callbacks
+        :return: spider instance
         """
+        #按配置开启后台线程输出日志及日志采样、限速
+        log_config = dict(LOG_CONFIG, **(cls.log_config or {}))
+        if log_config['QUEUE'] or log_config['SAMPLE_RATES'] or log_config['RATE_LIMITS']:
+            setup_logging(log_config['QUEUE'], log_config['SAMPLE_RATES'], log_config['RATE_LIMITS'])
         #创建新的Spider实例
-        spider_ins = cls(middleware=middleware, loop=loop)
+        spider_ins = cls(middleware=middleware, loop=loop, shard=shard, pipeline=pipeline)
         spider_ins.logger.info('Spider started')
         start_time = datetime.now()
 
@@ -87,109 +215,410 @@ class Spider:
             #统计失败请求数
             if spider_ins.failed_counts:
                 spider_ins.logger.info(f'Failed requests: {spider_ins.failed_counts}')
+            spider_ins.logger.info(spider_ins.stats.summary())
             spider_ins.logger.info(f'Time usage: {end_time-start_time}')
             spider_ins.logger.info('Spider finished!')
+            shutdown_logging()
             spider_ins.loop.run_until_complete(spider_ins.loop.shutdown_asyncgens())
             if close_event_loop:
                 spider_ins.loop.close()
+        return spider_ins
 
 
-    #中间件处理请求并发送和处理响应
-    async def handle_request(self, request):
-        await self._run_request_middleware(request)
-        callback_res, response = await request.fetch_callback(self.sem)
-        await self._run_response_middleware(request, response)
+    #创建共享连接池的会话，复用TCP/TLS连接及DNS解析结果
+    def _create_request_session(self):
+        connector_config = dict(CONNECTOR_CONFIG, **(self.connector_config or {}))
+        force_close = connector_config['FORCE_CLOSE']
+        connector = aiohttp.TCPConnector(
+            limit=connector_config['LIMIT'],
+            limit_per_host=connector_config['LIMIT_PER_HOST'],
+            #force_close时不允许设置keepalive_timeout
+            keepalive_timeout=None if force_close else connector_config['KEEPALIVE_TIMEOUT'],
+            force_close=force_close,
+            use_dns_cache=connector_config['USE_DNS_CACHE'],
+            ttl_dns_cache=connector_config['TTL_DNS_CACHE'],
+        )
+        #跟踪DNS解析、建立连接耗时及接收的字节数；超时由Request.fetch按TIMEOUT及MAX_DOWNLOAD_TIME控制，
+        #会话不使用aiohttp默认的整体300秒超时，否则较长的stream下载会被中断
+        return aiohttp.ClientSession(connector=connector, trace_configs=[create_trace_config()],
+                                     timeout=aiohttp.ClientTimeout(total=None))
+
+    #从响应中提取item，many为True时按target_item提取多个，否则提取单个；
+    #设置了parse_process_numbers时解析及提取在进程池中执行
+    async def extract_items(self, item_cls, response, many=True):
+        start = time.monotonic()
+        try:
+            if self.parse_pool is not None:
+                if response.body is not None:
+                    items = await self.parse_pool.get_items(item_cls, response.body, many=many,
+                                                            encoding=response.encoding)
+                else:
+                    items = await self.parse_pool.get_items(item_cls, response.html, many=many)
+                return items if many else items[0]
+            if many:
+                return await item_cls.get_items(html_etree=response.html_etree)
+            return await item_cls.get_item(html_etree=response.html_etree)
+        finally:
+            self.stats.observe('parse', time.monotonic() - start)
+
+    #发送请求并处理响应，response不为None时表示请求中间件已返回响应，无需再发起请求
+    async def handle_request(self, request, response=None):
+        if response is None:
+            #回调中产生的请求若未指定会话，则使用爬虫的共享会话
+            if request.request_session is None:
+                request.request_session = self.request_session
+            sem_start = time.monotonic()
+            async with self.concurrency_controller.slot(request.url):
+                started_at = time.monotonic()
+                self.stats.observe('sem_wait', started_at - sem_start)
+                response = await request.fetch()
+            self.stats.record_response(request, response)
+            self.concurrency_controller.feedback(request, response, started_at)
+            self.rate_limiter.feedback(request.url, response.status, response.headers)
+            #失败的请求不执行回调，释放并发信号量后延迟重新入队，返回的响应为None
+            retry_delay = self.retry_policy.get_retry_delay(request, response)
+            if retry_delay is not None:
+                self._schedule_retry(request, retry_delay)
+                return None, None
+        #响应中间件在回调前执行，可替换响应或要求重新请求
+        result = await self._run_response_middleware(request, response)
+        if isinstance(result, Reschedule):
+            reschedule_delay = self.retry_policy.get_reschedule_delay(request, result.delay)
+            if reschedule_delay is not None:
+                self._schedule_retry(request, reschedule_delay)
+                return None, None
+            self.logger.warning(f'<Reschedule ignored after {request.retry_count} retries: {request.url}>')
+        else:
+            response = result
+        callback_start = time.monotonic()
+        #协程生成器回调在此只是创建生成器，其迭代在_iterate_callback中分析
+        if self.profiler is None or isasyncgenfunction(request.callback):
+            callback_res = await request.process_callback(response)
+        else:
+            callback_res = await self.profiler.call('callback', request.callback, request.url,
+                                                    request.process_callback(response))
+        request.timings['callback'] = time.monotonic() - callback_start
         return callback_res, response
 
+    #延迟retry_delay秒后将请求重新入队
+    def _schedule_retry(self, request, retry_delay):
+        request.retry_count += 1
+        self.logger.info(f'<Retry url: {request.url}, Retry times: {request.retry_count}, Delay: {retry_delay:.2f}s>')
+        task = asyncio.ensure_future(self._retry_later(request, retry_delay))
+        self.retry_tasks.add(task)
+        task.add_done_callback(self.retry_tasks.discard)
+
+    async def _retry_later(self, request, retry_delay):
+        await asyncio.sleep(retry_delay)
+        retry_func = request.request_config.get('RETRY_FUNC')
+        #若设置了重试函数，则用其返回的请求代替原请求
+        if retry_func and iscoroutinefunction(retry_func):
+            request_ins = await retry_func(request)
+            if isinstance(request_ins, Request):
+                request_ins.retry_count = request.retry_count
+                request_ins.depth = request.depth
+                if self.frontier_store is not None:
+                    self.frontier_store.done(request)
+                    self.frontier_store.push(request_ins, self)
+                request = request_ins
+        #重试的请求不经过去重
+        self.request_queue.put_nowait(request)
+
 
 
 
     #任务开始入口
     async def start_master(self):
-        for url in self.start_urls:
-            #初始化Request实例
-            request_ins = Request(url=url,
-                                  callback=self.parse,
-                                  headers=getattr(self, 'headers', {}),
-                                  metadata=getattr(self, 'metadata', {}),
-                                  request_config=getattr(self, 'request_config'),
-                                  request_session=getattr(self, 'request_session', None),
-                                  res_type=getattr(self, 'res_type', 'text'),
-                                  **getattr(self, 'kwargs', {}))
-            #将由中间件处理过的request塞入request队列
-            self.request_queue.put_nowait(self.handle_request(request_ins))
-        #定义任务由两个工人完成
-        workers = [asyncio.ensure_future(self.start_worker()) for i in range(2)]
-        #确保队列请求完毕
-        await self.request_queue.join()
+        if self.request_session is None:
+            self.request_session = self._create_request_session()
+        if self.frontier_store is not None:
+            asyncio.ensure_future(self.frontier_store.run(self))
+            #存在上次未完成的请求时，恢复去重状态及请求队列，不再从start_urls开始
+            if self.frontier_store.has_pending():
+                self.frontier_store.load_dupefilter(self.dupefilter)
+                for request_ins in self.frontier_store.load_requests(self):
+                    self.request_queue.put_nowait(request_ins)
+                if self.shard is not None:
+                    self.shard.add(self.request_queue.qsize())
+                self.logger.info(f'Resumed {self.request_queue.qsize()} requests from {self.frontier_store.path}')
+        if self.shard is not None:
+            self.shard.start_receiving(self)
+        if self.pipeline is not None:
+            await self.pipeline.open(self)
+        if self.stats_config['LOG_INTERVAL']:
+            asyncio.ensure_future(self._report_stats())
+        if self.profiler is not None:
+            asyncio.ensure_future(self.profiler.monitor_loop_lag())
+        #没有可恢复的请求时从start_urls开始
+        if self.request_queue.qsize() == 0:
+            for url in self.start_urls:
+                #多进程运行时只处理属于本进程的start_urls
+                if self.shard is not None and not self.shard.owns(url):
+                    continue
+                #初始化Request实例
+                request_ins = Request(url=url,
+                                      callback=self.parse,
+                                      request_config=getattr(self, 'request_config'),
+                                      request_session=self.request_session,
+                                      res_type=getattr(self, 'res_type', 'text'),
+                                      **getattr(self, 'kwargs', {}))
+                #将request塞入request队列，取出时再交由中间件处理
+                self.enqueue_request(request_ins)
+        #释放ShardedRunner为本进程预占的计数
+        if self.shard is not None:
+            self.shard.done()
+        #启动工人，每个工人各自取任务、请求、回调并塞入新请求，互不等待
+        workers = [asyncio.ensure_future(self.start_worker()) for _ in range(self.worker_numbers)]
+        #确保队列请求完毕，等待重试的请求会在延迟后重新入队，因此需等待其全部入队后再次确认
+        while True:
+            await self.request_queue.join()
+            if self.retry_tasks:
+                await asyncio.wait(self.retry_tasks)
+                continue
+            #多进程运行时还需等待所有进程的请求都完成，其它进程仍可能转发请求过来
+            if self.shard is None or self.shard.finished():
+                break
+            await asyncio.sleep(0.1)
+        #等待管道中的item全部写入
+        if self.pipeline is not None:
+            await self.pipeline.join()
+        if self.frontier_store is not None:
+            self.frontier_store.clear()
         await self.stop(SIGINT)
 
 
+    #定期输出统计概要及写入统计快照
+    async def _report_stats(self):
+        interval = self.stats_config['LOG_INTERVAL']
+        last_total = 0
+        while True:
+            await asyncio.sleep(interval)
+            #汇总本周期的进度，代替逐个请求的日志
+            total = self.stats.success_counts + self.stats.failed_counts
+            self.logger.info(f'{self.stats.summary()}, last {interval}s: {total - last_total} pages, '
+                             f'queued: {self.request_queue.qsize()}, retrying: {len(self.retry_tasks)}')
+            last_total = total
+            self._write_stats()
+
+    def _write_stats(self):
+        try:
+            write_snapshot(self.stats,
+                           json_path=self.stats_config['JSON_PATH'],
+                           prometheus_path=self.stats_config['PROMETHEUS_PATH'])
+        except OSError as e:
+            self.logger.error(f'<Write stats error: {e}>')
+
+    #去重后将请求塞入队列，dont_filter为True的请求不去重，返回是否塞入
+    #多进程运行时不属于本进程的请求转发给所属进程，forwarded表示该请求由其它进程转发而来且已计数
+    def enqueue_request(self, request, forwarded=False):
+        if self.max_depth is not None and request.depth > self.max_depth:
+            self.logger.debug(f'<Ignored request beyond max depth: {request}>')
+            if forwarded:
+                self.shard.done()
+            return False
+        if self.shard is not None and not forwarded:
+            if not self.shard.owns(request.url) and self.shard.forward(request, self):
+                return True
+            self.shard.add()
+        if not request.dont_filter and self.dupefilter is not None and self.dupefilter.request_seen(request):
+            self.logger.debug(f'<Filtered duplicate request: {request}>')
+            if self.shard is not None:
+                self.shard.done()
+            return False
+        #先持久化再入队，队列中的请求描述需保存记录id
+        if self.frontier_store is not None:
+            self.frontier_store.push(request, self)
+        self.request_queue.put_nowait(request)
+        return True
+
     #执行任务
     async def start_worker(self):
         while True:
-            request_item = await self.request_queue.get()
-            #将任务塞入任务列表
-            self.worker_tasks.append(request_item)
-            #任务提取完毕后才执行
-            if self.request_queue.empty():
-                #此处使用gather，若出错，返回错误信息，继续执行其他协程
-                results = await asyncio.gather(*self.worker_tasks, return_exceptions=True)
-                for task_result in results:
-                    #对没有RuntimeError的结果进行下一步处理
-                    if not isinstance(task_result, RuntimeError):
-                        callback_res, res= task_result
-                        #若回调函数为协程生成器，则还有request产生，继续塞入请求队列
-                        if isinstance(callback_res, AsyncGeneratorType):
-                            async for request_ins in callback_res:
-                                self.request_queue.put_nowait(self.handle_request(request_ins))
-                        if res.html is None:
-                            self.failed_counts += 1
-                        else:
-                            self.success_counts += 1
-                #恢复任务列表，执行下一次循环
-                self.worker_tasks = []
-            #队列完成后的标志，否则将会一直被阻塞
+            #队列有空位时先恢复暂停的回调，bfs先恢复最早暂停的，dfs先恢复最近暂停的(通常更深)
+            if self.parked and self.request_queue.has_room():
+                state = self.parked.pop() if self.crawl_policy == 'dfs' else self.parked.popleft()
+                await self._run_callback(state)
+                continue
+            descriptor = await self.request_queue.get()
+            try:
+                request = descriptor.to_request()
+            except Exception as e:
+                #无法还原的请求(如子类的构造参数未加入to_dict)计为失败，不影响工人继续执行
+                self.logger.error(f'<Restore request failed: {descriptor.request_cls.__name__} '
+                                  f'{descriptor.data.get("url")} {e}>')
+                self.stats.failed_counts += 1
+                self.request_queue.refund(descriptor.data.get('url', ''))
+                self.request_queue.task_done()
+                #描述中保存了持久化队列的记录id，可同样从持久化队列中删除
+                self._finish_request(descriptor)
+                continue
+            self.stats.observe('queue_wait', time.monotonic() - request.enqueued_at)
+            request.set_defaults(self.headers, self.metadata)
+            #请求中间件可直接返回响应(如缓存)，此时不发起请求，返还出队时预定的令牌；返回DROP时丢弃该请求
+            response = await self._run_request_middleware(request)
+            if response is not None:
+                self.request_queue.refund(request.url)
+            if response is DROP:
+                self.logger.debug(f'<Dropped by middleware: {request.url}>')
+                self.stats.dropped_counts += 1
+                self.request_queue.task_done()
+                self._finish_request(request)
+                continue
+            await self._process_request(request, response)
+
+    #执行请求、回调并将新产生的请求塞入队列
+    async def _process_request(self, request, response=None):
+        try:
+            callback_res, res = await self.handle_request(request, response)
+        except asyncio.CancelledError:
+            #被取消的请求仍保留在持久化队列中，下次启动时重新请求
+            raise
+        except Exception as e:
+            #单个任务出错不影响工人继续执行其他任务
+            self.stats.failed_counts += 1
+            self.logger.exception(e)
+            self.request_queue.task_done()
+            self._finish_request(request)
+            return
+        #等待重试的请求仍保留在持久化队列中
+        if res is None:
             self.request_queue.task_done()
+            return
+        if isinstance(callback_res, AsyncGeneratorType) and self.profiler is not None:
+            callback_res = self._profile_callback(request, callback_res)
+        await self._run_callback(_CallbackState(request, res, callback_res))
+
+    #迭代回调并统计结果，回调暂停时请求尚未完成，task_done在恢复并迭代完毕后才调用
+    async def _run_callback(self, state):
+        request, res = state.request, state.response
+        try:
+            if await self._iterate_callback(state):
+                return
+            self.stats.observe('callback', request.timings.get('callback', 0) + state.callback_time)
+            if res.body is None and res.html is None:
+                self.stats.failed_counts += 1
+            else:
+                self.stats.success_counts += 1
+            #回调及中间件均已处理完毕，释放解析后的etree对象
+            res.release()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats.failed_counts += 1
+            self.logger.exception(e)
+        #队列完成后的标志，否则将会一直被阻塞
+        self.request_queue.task_done()
+        self._finish_request(request)
+
+    #若回调函数为协程生成器，产生的request立即塞入请求队列，item放入管道，管道缓冲区满时在此等待；
+    #请求队列达到上限时暂停回调并返回True：回调连同尚未入队的请求放入parked，工人继续出队，
+    #队列有空位时再由工人恢复，因此队列长度不超过MAX_SIZE，回调也始终在工人中执行
+    async def _iterate_callback(self, state):
+        if not isinstance(state.callback_res, AsyncGeneratorType):
+            return False
+        #回调耗时包括协程生成器的迭代，管道缓冲区满时的等待也计入其中，暂停的时间不计入
+        callback_start = time.monotonic()
+        try:
+            while True:
+                if state.pending is None:
+                    try:
+                        state.pending = await state.callback_res.__anext__()
+                    except StopAsyncIteration:
+                        return False
+                if isinstance(state.pending, Request):
+                    if not self.request_queue.has_room():
+                        self.parked.append(state)
+                        return True
+                    state.pending.depth = state.request.depth + 1
+                    self.enqueue_request(state.pending)
+                elif self.pipeline is not None:
+                    await self.pipeline.put(state.pending)
+                state.pending = None
+        finally:
+            state.callback_time += time.monotonic() - callback_start
+
+    #分析协程生成器回调每次迭代的耗时，yield之后入队及放入管道的耗时不计入
+    async def _profile_callback(self, request, callback_res):
+        record = self.profiler.begin('callback', request.callback, request.url)
+        try:
+            while True:
+                try:
+                    result = await self.profiler.run(record, callback_res.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield result
+        finally:
+            self.profiler.end(record)
+
+    #请求处理完毕，从持久化队列中删除并释放多进程运行时的计数
+    def _finish_request(self, request):
+        if self.frontier_store is not None:
+            self.frontier_store.done(request)
+        if self.shard is not None:
+            self.shard.done()
 
 
     #爬虫停止后续工作
     async def stop(self, _signal):
         self.logger.info(f'Stopping spider :{self.name}')
         #取消除当前任务以外的任务
-        tasks = [task for task in asyncio.Task.all_tasks() if task is not
-                 asyncio.tasks.Task.current_task()]
+        tasks = [task for task in asyncio.all_tasks() if task is not
+                 asyncio.current_task()]
         list(map(lambda task:task.cancel(), tasks))
         #此处gather确保取消一些任务后而不影响未取消的任务
         results = await asyncio.gather(*tasks, return_exceptions=True)
+        await self._close_resources()
         #停止事件循环前为避免异常需执行上述操作
         self.loop.stop()
 
+    #关闭爬虫创建的资源，子类可扩展
+    async def _close_resources(self):
+        #写入未完成的请求及去重状态
+        if self.frontier_store is not None:
+            self.frontier_store.close(self.dupefilter)
+            self.frontier_store = None
+        if self.parse_pool is not None:
+            self.parse_pool.close()
+        #写入管道中剩余的item
+        if self.pipeline is not None:
+            await self.pipeline.close()
+        self._write_stats()
+        #关闭由爬虫创建的共享会话
+        if self.close_request_session and self.request_session is not None:
+            await self.request_session.close()
+            self.request_session = None
 
-    #请求中间件处理
+
+    #请求中间件处理，某个中间件返回Response或DROP时跳过后续中间件并返回该结果
     async def _run_request_middleware(self, request):
-        if self.middleware.request_middleware:
-            for middleware in self.middleware.request_middleware:
-                middleware_func = middleware(request)
-                if isawaitable(middleware_func):
-                    try:
-                        result = await middleware_func
-                    except Exception as e:
-                        self.logger.exception(e)
+        for middleware in self.request_middleware:
+            try:
+                if self.profiler is None:
+                    result = await middleware(request)
                 else:
-                    self.logger.error('Middleware must be coroutine function!')
-                    result = None
+                    result = await self.profiler.call('middleware', middleware, request.url, middleware(request))
+            except Exception as e:
+                self.logger.exception(e)
+                continue
+            if result is DROP or isinstance(result, Response):
+                return result
+        return None
 
-    #响应中间件处理
+    #响应中间件处理，某个中间件返回Response时之后的中间件及回调使用该响应，
+    #返回Reschedule时跳过后续中间件并返回该信号，否则返回最终的响应
     async def _run_response_middleware(self, request, response):
-        if self.middleware.response_middleware:
-            for middleware in self.middleware.response_middleware:
-                middleware_func = middleware(request, response)
-                if isawaitable(middleware_func):
-                    try:
-                        result = await middleware_func
-                    except Exception as e:
-                        self.logger.exception(e)
+        for middleware in self.response_middleware:
+            try:
+                if self.profiler is None:
+                    result = await middleware(request, response)
                 else:
-                    self.logger.error('Middleware must be a coroutine function')
-                    result = None
+                    result = await self.profiler.call('middleware', middleware, request.url,
+                                                      middleware(request, response))
+            except Exception as e:
+                self.logger.exception(e)
+                continue
+            if isinstance(result, Reschedule):
+                return result
+            if isinstance(result, Response):
+                response = result
+        return response
@@ -0,0 +1,216 @@
+#-*-coding:utf8-*-
+
+import bisect
+import json
+import os
+import time
+
+from collections import Counter, defaultdict
+from urllib.parse import urlparse
+
+import aiohttp
+
+
+#耗时直方图的桶上界，单位为秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+#请求各阶段：排队、限速等待、并发信号量等待、DNS解析、建立连接、首字节、下载、解析、回调
+PHASES = ('queue_wait', 'throttle', 'sem_wait', 'dns', 'connect', 'ttfb', 'download', 'parse', 'callback')
+
+
+#固定桶的直方图，与Prometheus的histogram相同，分位数按桶线性插值估算
+class Histogram:
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        #最后一个为+Inf桶
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99)}
+
+    def merge(self, data):
+        self.counts = [a + b for a, b in zip(self.counts, data['counts'])]
+        self.sum += data['sum']
+        self.count += data['count']
+
+
+#单个爬虫实例的统计信息：成功失败数、状态码、各阶段耗时及按域名的请求数、耗时、流量
+class CrawlStats:
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.success_counts, self.failed_counts = 0, 0
+        #被请求中间件丢弃的请求数
+        self.dropped_counts = 0
+        self.status_counts = Counter()
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.host_latency = defaultdict(Histogram)
+        self.host_bytes = Counter()
+        self.total_bytes = 0
+        #其它模块的统计信息，如自适应并发，值为字典或带to_dict方法的对象
+        self.extra = {}
+
+    def observe(self, phase, value):
+        self.phases[phase].observe(value)
+
+    #记录一次请求的响应，包括Request.fetch中记录的各阶段耗时
+    def record_response(self, request, response):
+        self.status_counts[response.status] += 1
+        timings = request.timings
+        for phase in ('dns', 'connect', 'ttfb', 'download'):
+            if phase in timings:
+                self.phases[phase].observe(timings[phase])
+        host = urlparse(request.url).hostname or ''
+        if 'ttfb' in timings:
+            self.host_latency[host].observe(timings['ttfb'] + timings.get('download', 0))
+        size = timings.get('bytes', 0)
+        self.host_bytes[host] += size
+        self.total_bytes += size
+
+    def to_dict(self):
+        return {
+            'elapsed': time.time() - self.start_time,
+            'success_counts': self.success_counts,
+            'failed_counts': self.failed_counts,
+            'dropped_counts': self.dropped_counts,
+            'status_counts': {str(status): count for status, count in self.status_counts.items()},
+            'total_bytes': self.total_bytes,
+            'phases': {phase: histogram.to_dict() for phase, histogram in self.phases.items()},
+            'hosts': {
+                host: {'latency': histogram.to_dict(), 'bytes': self.host_bytes[host]}
+                for host, histogram in self.host_latency.items()
+            },
+            'extra': {key: value.to_dict() if hasattr(value, 'to_dict') else value for key, value in self.extra.items()},
+        }
+
+    #一行概要，用于定期日志
+    def summary(self):
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        total = self.success_counts + self.failed_counts
+        ttfb = self.phases['ttfb']
+        return (f'Crawled {total} pages ({total / elapsed * 60:.1f} pages/min), failed: {self.failed_counts}, '
+                f'ttfb p50/p99: {ttfb.quantile(0.5):.3f}s/{ttfb.quantile(0.99):.3f}s, '
+                f'downloaded: {self.total_bytes / 1048576:.1f}MB')
+
+
+#将to_dict的结果转换为Prometheus文本格式，可由node_exporter的textfile collector读取
+def to_prometheus(data, prefix='ruia'):
+    lines = []
+
+    def histogram_lines(name, histogram, labels):
+        cumulative = 0
+        for upper, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{upper}"}} {cumulative}')
+        label_str = '{%s}' % labels.rstrip(',') if labels else ''
+        lines.append(f'{name}_sum{label_str} {histogram["sum"]}')
+        lines.append(f'{name}_count{label_str} {histogram["count"]}')
+
+    lines.append(f'# TYPE {prefix}_requests_total counter')
+    lines.append(f'{prefix}_requests_total{{result="success"}} {data["success_counts"]}')
+    lines.append(f'{prefix}_requests_total{{result="failed"}} {data["failed_counts"]}')
+    lines.append(f'# TYPE {prefix}_responses_total counter')
+    for status, count in sorted(data['status_counts'].items()):
+        lines.append(f'{prefix}_responses_total{{status="{status}"}} {count}')
+    lines.append(f'# TYPE {prefix}_phase_seconds histogram')
+    for phase, histogram in data['phases'].items():
+        histogram_lines(f'{prefix}_phase_seconds', histogram, f'phase="{phase}",')
+    #同一指标的样本须连续输出在其TYPE行之后
+    hosts = sorted(data['hosts'].items())
+    lines.append(f'# TYPE {prefix}_host_latency_seconds histogram')
+    for host, host_data in hosts:
+        histogram_lines(f'{prefix}_host_latency_seconds', host_data['latency'], f'host="{host}",')
+    lines.append(f'# TYPE {prefix}_host_bytes_total counter')
+    for host, host_data in hosts:
+        lines.append(f'{prefix}_host_bytes_total{{host="{host}"}} {host_data["bytes"]}')
+    return '\n'.join(lines) + '\n'
+
+
+#合并多个进程的统计信息，用于ShardedRunner
+def merge_stats(stats_list):
+    merged = CrawlStats()
+    merged.start_time = time.time() - max((data['elapsed'] for data in stats_list), default=0)
+    for data in stats_list:
+        merged.success_counts += data['success_counts']
+        merged.failed_counts += data['failed_counts']
+        merged.dropped_counts += data['dropped_counts']
+        merged.status_counts.update({int(status): count for status, count in data['status_counts'].items()})
+        merged.total_bytes += data['total_bytes']
+        for phase, histogram in data['phases'].items():
+            merged.phases[phase].merge(histogram)
+        for host, host_data in data['hosts'].items():
+            merged.host_latency[host].merge(host_data['latency'])
+            merged.host_bytes[host] += host_data['bytes']
+    return merged
+
+
+#写入统计文件，先写临时文件再替换，避免读取到写了一半的文件
+def write_snapshot(stats, json_path=None, prometheus_path=None):
+    data = stats.to_dict()
+    for path, content in ((json_path, lambda: json.dumps(data, ensure_ascii=False)),
+                          (prometheus_path, lambda: to_prometheus(data))):
+        if path:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(content())
+            os.replace(path + '.tmp', path)
+
+
+#aiohttp请求跟踪，DNS解析、建立连接耗时及接收的字节数写入Request.timings(由trace_request_ctx传入)
+async def _on_dns_resolvehost_start(session, context, params):
+    context.dns_start = time.monotonic()
+
+
+async def _on_dns_resolvehost_end(session, context, params):
+    if isinstance(context.trace_request_ctx, dict):
+        context.trace_request_ctx['dns'] = time.monotonic() - context.dns_start
+
+
+async def _on_connection_create_start(session, context, params):
+    context.connect_start = time.monotonic()
+
+
+#建立连接的耗时包括DNS解析，此处减去DNS解析耗时
+async def _on_connection_create_end(session, context, params):
+    timings = context.trace_request_ctx
+    if isinstance(timings, dict):
+        timings['connect'] = time.monotonic() - context.connect_start - timings.get('dns', 0)
+
+
+async def _on_response_chunk_received(session, context, params):
+    timings = context.trace_request_ctx
+    if isinstance(timings, dict):
+        timings['bytes'] = timings.get('bytes', 0) + len(params.chunk)
+
+
+def create_trace_config():
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_dns_resolvehost_start.append(_on_dns_resolvehost_start)
+    trace_config.on_dns_resolvehost_end.append(_on_dns_resolvehost_end)
+    trace_config.on_connection_create_start.append(_on_connection_create_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_response_chunk_received.append(_on_response_chunk_received)
+    return trace_config
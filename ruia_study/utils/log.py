@@ -1,27 +1,132 @@
 #-*-coding:utf8-*-
 
 import logging
+import queue
+import time
+
+from collections import Counter, defaultdict
+from logging.handlers import QueueHandler, QueueListener
+
+#日志格式
+LOGGING_FORMAT = "[%(asctime)s]-%(name)s-%(levelname)-6s%(module)-7s: %(message)s"
+
+#是否已配置过日志
+_configured = False
+#setup_logging的状态：事件过滤器、原来的根日志处理器、队列处理器及后台监听器
+_active = None
+
 
 def get_logger(name='Ruia'):
-    #日志格式
-    logging_format = "[%(asctime)s]-%(name)s-%(levelname)-6s"
-    logging_format += "%(module)-7s: "
-    logging_format += "%(message)s"
-
-    #日志配置
-    logging.basicConfig(
-        format = logging_format,
-        level = logging.DEBUG,
-    )
-
-    #此处将下面三个模块的info级别以下及debug信息不打印到控制台
-    logging.getLogger('asyncio').setLevel(logging.INFO)
-    logging.getLogger('pyppeteer').setLevel(logging.INFO)
-    logging.getLogger('websockets').setLevel(logging.INFO)
+    global _configured
+    #日志配置只需进行一次
+    if not _configured:
+        _configured = True
+        logging.basicConfig(
+            format = LOGGING_FORMAT,
+            level = logging.DEBUG,
+        )
+
+        #此处将下面三个模块的info级别以下及debug信息不打印到控制台
+        logging.getLogger('asyncio').setLevel(logging.INFO)
+        logging.getLogger('pyppeteer').setLevel(logging.INFO)
+        logging.getLogger('websockets').setLevel(logging.INFO)
 
     return logging.getLogger(name)
 
 
+#按事件采样及限速的过滤器，事件为"日志名.级别"，如'Request.INFO'为每个请求的日志，'Request.ERROR'为请求失败的日志
+#sample_rates为事件输出的比例，如{'Request.INFO': 0.01}为每100条输出1条，0为不输出；
+#rate_limits为事件每秒最多输出的条数，超出的不输出，下次输出时附带被抑制的条数
+class EventFilter(logging.Filter):
+
+    def __init__(self, sample_rates=None, rate_limits=None):
+        super(EventFilter, self).__init__()
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limits = dict(rate_limits or {})
+        self.credits = defaultdict(float)
+        #每个事件当前一秒窗口的开始时间及已输出条数
+        self.windows = {}
+        self.suppressed = Counter()
+
+    def filter(self, record):
+        event = f'{record.name}.{record.levelname}'
+        rate = self.sample_rates.get(event)
+        if rate is not None:
+            #按比例累积，满1条时输出，结果是确定的且均匀分布
+            self.credits[event] += rate
+            if self.credits[event] < 1:
+                return False
+            self.credits[event] -= 1
+        limit = self.rate_limits.get(event)
+        if limit is not None:
+            now = time.monotonic()
+            start, count = self.windows.get(event, (now, 0))
+            if now - start >= 1:
+                start, count = now, 0
+            if count >= limit:
+                self.windows[event] = (start, count)
+                self.suppressed[event] += 1
+                return False
+            self.windows[event] = (start, count + 1)
+            suppressed = self.suppressed.pop(event, 0)
+            if suppressed:
+                record.msg, record.args = f'{record.getMessage()} ({suppressed} similar messages suppressed)', None
+        return True
+
+
+#只在调用线程中合并消息参数，时间等格式化、异常堆栈的格式化及输出均在监听线程中进行
+class _QueueHandler(QueueHandler):
+
+    def prepare(self, record):
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+
+#配置根日志：按事件采样及限速；use_queue为True时根日志的处理器改由后台线程的QueueListener调用，
+#事件循环中记录日志只需放入队列，格式化及写入stderr等IO不再阻塞事件循环
+#与shutdown_logging成对调用，Spider.start按LOG_CONFIG自动调用
+def setup_logging(use_queue=False, sample_rates=None, rate_limits=None):
+    global _active
+    get_logger()
+    shutdown_logging()
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    event_filter = EventFilter(sample_rates, rate_limits)
+    queue_handler, listener = None, None
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        queue_handler = _QueueHandler(log_queue)
+        queue_handler.addFilter(event_filter)
+        for handler in handlers:
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+    else:
+        for handler in handlers:
+            handler.addFilter(event_filter)
+    _active = (event_filter, handlers, queue_handler, listener)
+    return event_filter
+
+
+#输出队列中剩余的日志，恢复setup_logging之前的根日志处理器
+def shutdown_logging():
+    global _active
+    if _active is None:
+        return
+    event_filter, handlers, queue_handler, listener = _active
+    _active = None
+    root = logging.getLogger()
+    if queue_handler is not None:
+        root.removeHandler(queue_handler)
+        listener.stop()
+        for handler in handlers:
+            root.addHandler(handler)
+    else:
+        for handler in handlers:
+            handler.removeFilter(event_filter)
+
+
 if __name__ == '__main__':
     logger = get_logger('asyncio')
-    logger.debug("debug")
\ No newline at end of file
+    logger.debug("debug")